@@ -0,0 +1,146 @@
+"""
+An observation/action interface for agents controlling the robot.
+
+Agents subclass `Agent` and implement `new_obs()` (to receive each decoded
+frame) and `action()` (to choose what to do next). `AgentRunner` drives an
+agent from a `scheduler.ControlLoop`, delivering a frame as an observation
+each tick and sending the resulting action before the next frame arrives.
+
+The agent runs in a worker thread, and the control loop only waits for it
+until the latency budget (measured from when the frame arrived) runs out.
+If the agent overruns, a fallback action is sent instead -- by default the
+last action is repeated, or with `overrun="stop"` the robot is stopped -- so
+a slow learner cannot stall the robot. The agent is not given a new
+observation until it has finished with the current one, and an action that
+arrives after its budget has run out is discarded (and counted as stale),
+since it was computed from an old observation.
+Latency is measured from the arrival of the observation an action was
+computed from to the action being sent.
+
+Example:
+    class Forward(Agent):
+        def new_obs(self, timestamp, frame):
+            self.bumped = frame['BumpsAndWheelDrops'] & 3
+        def action(self):
+            return (0, 0) if self.bumped else (100, 100)
+
+    runner = AgentRunner(robot, csp3([7]), Forward(), budget=0.010)
+    robot.request_stream(7)
+    runner.run()
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from scheduler import ControlLoop
+from stats import Histogram
+
+
+class Agent:
+    def new_obs(self, timestamp, frame):
+        """Receive an observation (a decoded frame, and when it arrived)."""
+        pass
+
+    def action(self):
+        """Return the next action, by default `(right, left)` velocities."""
+        raise NotImplementedError
+
+    def step(self, timestamp, frame):
+        self.new_obs(timestamp, frame)
+        return self.action()
+
+
+class AgentRunner:
+    def __init__(self, robot, parser, agent, budget=0.010, overrun='repeat',
+                 every=1, send=None):
+        """
+        Args:
+            robot: the `Controller` for the robot.
+            parser: the `csp3` parser for the stream.
+            agent: the `Agent` to run.
+            budget: the time (after a frame arrives) by which its action must
+                be ready.
+            overrun: what to do if the agent misses the budget, either
+                "repeat" (send the last action again) or "stop".
+            every: the number of frames per tick.
+            send: a function `send(robot, action)` to send an action; by
+                default actions are `(right, left)` wheel velocities.
+        """
+        if overrun not in ('repeat', 'stop'):
+            raise ValueError("Unknown overrun policy: %s" % overrun)
+        self.robot = robot
+        self.agent = agent
+        self.budget = budget
+        self.overrun = overrun
+        self.send = send if send is not None else self.drive
+        self.loop = ControlLoop(robot, parser, self.tick, every=every,
+                                deadline=budget)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = None
+        # When the observation being worked on by `future` arrived
+        self.obs_stamp = None
+        self.last_action = None
+
+        # Statistics
+        self.actions = 0
+        self.overruns = 0
+        self.stale = 0
+        self.latency = Histogram()
+
+    @staticmethod
+    def drive(robot, action):
+        robot.drive_direct(*action)
+
+    def run(self, max_ticks=None):
+        try:
+            self.loop.run(max_ticks)
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def stop(self):
+        self.loop.stop()
+
+    def tick(self, frames):
+        timestamp, frame = frames[-1]
+        if self.future is not None and self.future.done():
+            # finished after its budget ran out, so the action is stale
+            self.future.result()
+            self.future = None
+            self.stale += 1
+        if self.future is None:
+            self.future = self.executor.submit(self.agent.step, timestamp, frame)
+            self.obs_stamp = timestamp
+        fresh = False
+        if self.obs_stamp == timestamp:
+            try:
+                remaining = timestamp + self.budget - self.robot.clock()
+                action = self.future.result(timeout=max(0, remaining))
+                self.future = None
+                fresh = True
+            except TimeoutError:
+                pass
+        if fresh:
+            self.actions += 1
+        else:
+            # still working on this (or an older) observation
+            self.overruns += 1
+            action = self.fallback()
+        if action is None:
+            self.robot.stop()
+        else:
+            self.send(self.robot, action)
+            self.last_action = action
+        if fresh:
+            self.latency.add(self.robot.clock() - self.obs_stamp)
+
+    def fallback(self):
+        """The action to take when the agent misses its budget."""
+        if self.overrun == 'repeat':
+            return self.last_action
+        return None
+
+    def report(self):
+        ret = self.loop.report()
+        ret.update({'actions': self.actions,
+                    'overruns': self.overruns,
+                    'stale': self.stale,
+                    'latency': self.latency.summary()})
+        return ret
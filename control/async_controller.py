@@ -0,0 +1,207 @@
+"""
+An asyncio version of `Controller` for the iRobot Create.
+
+The serial port's file descriptor is put in non-blocking mode and registered
+with the event loop, so reading the sensor stream and sending commands never
+blocks. Several robots (along with network I/O, camera capture, etc.) can be
+run concurrently from a single event loop.
+
+Example:
+    async def main():
+        robot = await AsyncController.open('/dev/ttyUSB0', create.SERIAL_PARAMS)
+        await robot.mode_passive()
+        async for frame in robot.stream(21, 22, 23):
+            print(frame)
+"""
+import asyncio
+import os
+
+import serial
+
+import create_v1 as create
+from commands import COMMANDS
+from csp3 import csp3
+from sequence import set_rts
+
+
+class AsyncController:
+    def __init__(self, ser, loop=None):
+        self.ser = ser
+        self.fd = ser.fileno()
+        os.set_blocking(self.fd, False)
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.parser = None
+        self.frames = asyncio.Queue()
+        # Outgoing bytes that could not be written immediately
+        self.out = bytearray()
+        self.drained = None
+        # Set if the port hangs up (e.g., the adapter is unplugged)
+        self.error = None
+
+    @classmethod
+    async def open(cls, port_name, serial_params, reset=True):
+        """Open a serial port for connecting to the robot."""
+        ser = serial.Serial(port_name, **serial_params)
+        if reset:
+            set_rts(ser, 0)
+            await asyncio.sleep(0.25)
+            set_rts(ser, 1)
+            await asyncio.sleep(0.25)
+            ser.flushOutput()
+        return cls(ser, asyncio.get_running_loop())
+
+    async def shutdown(self):
+        """Shutdown. Pause stream, set mode to passive, and close serial port."""
+        try:
+            await self.pause_stream()
+            await asyncio.sleep(1.5)
+            await self.mode_passive()
+            await asyncio.sleep(1.5)
+        finally:
+            self.close()
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        self.ser.close()
+
+    async def send_cmd(self, *lst):
+        """Send a command (here, a list of integers) to the robot.
+
+        The bytes are written immediately if the port can accept them, and
+        otherwise when the port becomes writable.
+
+        Returns:
+            int: the number of bytes sent
+        """
+        self.write(bytes(lst))
+        if self.drained is not None:
+            await asyncio.shield(self.drained)
+        return len(lst)
+
+    async def send_command(self, command, *args):
+        """Encode a `commands.Command` and send it."""
+        self.write(command.encode(*args))
+        if self.drained is not None:
+            await asyncio.shield(self.drained)
+        return command.size
+
+    def write(self, data):
+        """Write `data` without blocking, queueing whatever doesn't fit."""
+        if not self.out:
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                pass
+            if not data:
+                return
+            self.drained = self.loop.create_future()
+            self.loop.add_writer(self.fd, self._on_writable)
+        self.out += data
+
+    def _on_writable(self):
+        try:
+            del self.out[:os.write(self.fd, self.out)]
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._on_hangup(e)
+            return
+        if not self.out:
+            self.loop.remove_writer(self.fd)
+            self.drained.set_result(None)
+            self.drained = None
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._on_hangup(e)
+            return
+        if not data:
+            # readable but empty means the port has hung up
+            self._on_hangup(EOFError("Serial port closed: %s" % self.ser.port))
+            return
+        self.parser.feed(data)
+        while self.parser.buffer:
+            self.frames.put_nowait(self.parser.buffer.pop(0))
+
+    def _on_hangup(self, error):
+        """Stop reading and writing, and end the stream with `error`.
+
+        Any pending write fails with `error`, as does the stream.
+        """
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        self.out.clear()
+        if self.drained is not None:
+            self.drained.set_exception(error)
+            self.drained = None
+        if self.error is None:
+            self.error = error
+            self.frames.put_nowait(error)
+
+    async def stream(self, *sensor_ids, **kwargs):
+        """Request a stream of `sensor_ids` and yield each decoded frame.
+
+        Keyword arguments are passed on to `csp3`. The stream is paused when
+        the iteration stops. If the port hangs up, the stream ends by raising
+        `EOFError` (or the `OSError` from reading or writing the port).
+        """
+        self.parser = csp3(list(sensor_ids), **kwargs)
+        self.frames = asyncio.Queue()
+        self.loop.add_reader(self.fd, self._on_readable)
+        await self.request_stream(*sensor_ids)
+        try:
+            while True:
+                frame = await self.frames.get()
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+        finally:
+            self.loop.remove_reader(self.fd)
+            if self.ser.is_open and self.error is None:
+                await self.pause_stream()
+
+    async def mode_full(self):
+        """Set mode to full."""
+        return await self.cmd_full()
+
+    async def mode_safe(self):
+        """Set mode to safe."""
+        return await self.cmd_safe()
+
+    async def mode_passive(self):
+        """Set mode to passive."""
+        return await self.cmd_start()
+
+    async def pause_stream(self):
+        """Pause the stream."""
+        return await self.cmd_pause_resume(0)
+
+    async def request_stream(self, *sensor_ids):
+        """Request a stream of the sensors specified by `sensor_ids`."""
+        return await self.send_cmd(create.OP_STREAM, len(sensor_ids), *sensor_ids)
+
+    async def run_demo(self, num):
+        """Run a built-in demo (num : 0, 1, 2, ..., 9)."""
+        ret = await self.stop_demo()
+        ret += await self.cmd_demo(num)
+        return ret
+
+    async def stop_demo(self):
+        return await self.cmd_demo(-1)
+
+
+def _command_method(command):
+    async def method(self, *args):
+        return await self.send_command(command, *args)
+    method.__name__ = "cmd_" + command.name
+    method.__doc__ = command.doc
+    return method
+
+# Generate a `cmd_<name>` coroutine for each command in the opcode table
+for _command in COMMANDS.values():
+    setattr(AsyncController, "cmd_" + _command.name, _command_method(_command))
@@ -0,0 +1,129 @@
+"""
+Serial bandwidth planning for sensor streams.
+
+The Create sends a stream packet every 15 ms, and it is up to us not to
+request more data than fits in that time at the current baud rate; otherwise
+the stream overruns and we get misaligned packets. With 8N1 framing each byte
+takes 10 bits, so at 57600 baud only about 86 bytes fit in each period.
+
+The serial link is full duplex, so sensor data (robot to host) and commands
+(host to robot) are budgeted separately; the planner reports the headroom in
+each direction per stream period.
+
+If the requested sensors don't fit in a single stream packet, `plan()` splits
+them into groups that do, which can then be streamed in turn using
+`AlternatingStream`; each sensor is then delivered once every
+`len(groups)` periods.
+"""
+from collections import namedtuple
+
+import schema
+
+
+STREAM_PERIOD = 0.015
+BITS_PER_BYTE = 10
+
+Plan = namedtuple('Plan', ['groups', 'frame_sizes', 'budget', 'rx_headroom',
+                           'tx_headroom'])
+
+
+def bytes_per_period(baudrate, period=STREAM_PERIOD):
+    """The number of bytes that can be sent in one stream period."""
+    return baudrate * period / BITS_PER_BYTE
+
+
+def frame_size(sensor_ids):
+    """The size (in bytes) of a stream packet for `sensor_ids`."""
+    return schema.layout(sensor_ids).total_bytes
+
+
+def stream_cmd_size(sensor_ids):
+    """The size (in bytes) of the command requesting a stream of `sensor_ids`."""
+    return len(sensor_ids) + 2
+
+
+def fits(sensor_ids, baudrate, period=STREAM_PERIOD, margin=1.0):
+    """Check if a stream packet for `sensor_ids` fits within one period."""
+    return frame_size(sensor_ids) <= margin * bytes_per_period(baudrate, period)
+
+
+def split(sensor_ids, capacity):
+    """Split `sensor_ids` into groups whose stream packets fit in `capacity`.
+
+    Uses first-fit decreasing bin packing; each group's packet costs 3 bytes
+    of overhead plus one ID byte and the data bytes for every sensor.
+    """
+    packets = schema.load().packets
+    cost = {i: packets[i].size + 1 for i in sensor_ids}
+    if any(3 + c > capacity for c in cost.values()):
+        raise ValueError("A single sensor does not fit in %d bytes" % capacity)
+    groups = []
+    used = []
+    for i in sorted(sensor_ids, key=lambda x: -cost[x]):
+        for j, group in enumerate(groups):
+            if used[j] + cost[i] <= capacity:
+                group.append(i)
+                used[j] += cost[i]
+                break
+        else:
+            groups.append([i])
+            used.append(3 + cost[i])
+    # keep the requested order within each group
+    order = {x: n for n, x in enumerate(sensor_ids)}
+    return [sorted(g, key=order.get) for g in groups]
+
+
+def plan(sensor_ids, baudrate=57600, period=STREAM_PERIOD, command_bytes=0,
+         margin=0.9):
+    """Plan how to stream `sensor_ids` within the available bandwidth.
+
+    Args:
+        sensor_ids: the sensors requested.
+        baudrate: the serial link's baud rate.
+        period: the time between stream packets.
+        command_bytes: the number of bytes of commands sent each period.
+        margin: the fraction of the bandwidth that may be used.
+
+    Returns:
+        Plan: the groups to stream (a single group if everything fits), the
+        size of each group's packet, the budget (bytes per period), and the
+        worst-case headroom (bytes per period) in each direction.
+    """
+    budget = margin * bytes_per_period(baudrate, period)
+    sensor_ids = list(sensor_ids)
+    if frame_size(sensor_ids) <= budget:
+        groups = [sensor_ids]
+    else:
+        groups = split(sensor_ids, int(budget))
+    sizes = [frame_size(g) for g in groups]
+    # alternating streams requires a stream command every period
+    tx = command_bytes
+    if len(groups) > 1:
+        tx += max(stream_cmd_size(g) for g in groups)
+    return Plan(groups=groups,
+                frame_sizes=sizes,
+                budget=budget,
+                rx_headroom=budget - max(sizes),
+                tx_headroom=budget - tx)
+
+
+class AlternatingStream:
+    """Stream several groups of sensors in turn, switching every frame.
+
+    Call `step()` after each frame has been received; the parser switches
+    layouts using `csp3.reconfigure()`, so no frames are lost in between.
+    """
+    def __init__(self, robot, parser, groups):
+        self.robot = robot
+        self.parser = parser
+        self.groups = groups
+        self.index = 0
+
+    def start(self):
+        self.robot.reconfigure_stream(self.parser, *self.groups[0])
+
+    def step(self):
+        if len(self.groups) == 1:
+            return
+        self.index = (self.index + 1) % len(self.groups)
+        self.robot.reconfigure_stream(self.parser, *self.groups[self.index])
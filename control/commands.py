@@ -0,0 +1,87 @@
+"""
+Precompiled encoders for the commands in `create_v1.opcode_dct`.
+
+Each command with fixed-size arguments gets a `Command` with its own
+`struct.Struct` (opcode followed by the big-endian arguments), so encoding a
+command is a clamp of each argument followed by a single `pack_into`.
+`Controller` generates a `cmd_<name>` method for each of these.
+"""
+import struct
+
+import create_v1 as create
+from create_v1 import opcode_dct
+
+
+def clamp(x, lo, hi):
+    x = int(x)
+    return lo if x < lo else (hi if x > hi else x)
+
+
+class Command:
+    def __init__(self, opcode, name, args):
+        self.opcode = opcode
+        self.name = name
+        self.arg_names = [a[0] for a in args]
+        self.lo = [a[2] for a in args]
+        self.hi = [a[3] for a in args]
+        self.struct = struct.Struct(">B" + "".join(a[1] for a in args))
+        self.size = self.struct.size
+
+    @property
+    def doc(self):
+        args = ", ".join("%s=[%d, %d]" % x for x in zip(self.arg_names, self.lo, self.hi))
+        return "Send the `%s` command (opcode %d). Arguments: %s" % (
+            self.name, self.opcode, args or "none")
+
+    def pack_into(self, buf, offset, *args):
+        """Encode the command into `buf` at `offset`, clamping arguments.
+
+        Returns:
+            int: the number of bytes written
+        """
+        if len(args) != len(self.lo):
+            raise TypeError("%s takes %d arguments (%d given)" %
+                            (self.name, len(self.lo), len(args)))
+        self.struct.pack_into(buf, offset, self.opcode,
+                              *map(clamp, args, self.lo, self.hi))
+        return self.size
+
+    def encode(self, *args):
+        """Encode the command as a new `bytes` object."""
+        buf = bytearray(self.size)
+        self.pack_into(buf, 0, *args)
+        return bytes(buf)
+
+
+# Encoders for every command with fixed-size arguments, by name
+COMMANDS = {v['name']: Command(k, v['name'], v['args'])
+            for k, v in opcode_dct.items() if v['args'] is not None}
+
+# Sizes of the fixed-length commands, including the opcode
+COMMAND_SIZES = {c.opcode: c.size for c in COMMANDS.values()}
+
+
+def command_size(buf):
+    """The size of the command at the start of `buf`.
+
+    Returns:
+        int: the size in bytes, or None if more of `buf` is needed to tell.
+        Unknown opcodes count as a single byte.
+    """
+    op = buf[0]
+    if op in COMMAND_SIZES:
+        return COMMAND_SIZES[op]
+    if op in (create.OP_STREAM, create.OP_QUERY_LIST, create.OP_SCRIPT):
+        return 2 + buf[1] if len(buf) >= 2 else None
+    if op == create.OP_SONG:
+        return 3 + 2 * buf[2] if len(buf) >= 3 else None
+    return 1
+
+
+def split_commands(data):
+    """Split a buffer of encoded commands into the individual commands."""
+    ix = 0
+    while ix < len(data):
+        size = command_size(data[ix:ix+3]) or len(data) - ix
+        yield data[ix:ix+size]
+        ix += size
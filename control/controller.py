@@ -1,113 +1,787 @@
 """
 Code for controlling the iRobot Create.
 
-TODO: Ensure sleep called as infrequently and for as short a time as possible
+Opening, shutting down and resetting the robot are done via the
+non-blocking sequences in `sequence.py`; use `open_all()` and
+`shutdown_all()` to do these for many robots in parallel.
 """
+import errno
+import os
+import queue
 import select
 import serial
-import struct
-from time import sleep, time 
+import statistics
+import threading
+import warnings
+from contextlib import contextmanager
+from time import monotonic, sleep, time
 
+import bandwidth
 import create_v1 as create 
-from csp3 import csp3
+from commands import COMMANDS
+from csp3 import csp3, infer_layout
+from discovery import backoff_delays, find_port
+from latency import PROBE_IDS, ActuationProbe
+from recorder import READ, WRITE, Recorder
+from sequence import (open_sequence, run_sequences, shutdown_sequence,
+                      soft_reset_sequence)
+from watchdog import Watchdog
+from writequeue import (BACKGROUND, CONTROL, SAFETY, WriteQueue,
+                        priority_of)
 
 
 class Controller:
-    def __init__(self, port_name, serial_params):
-        self.ser = self.open_port(port_name, serial_params)
+    # Initial size of the buffer used to accumulate batched commands
+    BATCH_SIZE = 64
+    # How often to check whether a held drive command can be sent
+    DRIVE_POLL = 0.001
+
+    def __init__(self, port_name, serial_params, reset=True):
+        self.ser = self.open_port(port_name, serial_params, reset=reset)
+        self.port_name = port_name
+        self.serial_params = serial_params
+        self.init_state()
+
+    def init_state(self):
+        """Set up the controller's buffers and bookkeeping."""
+        # Commands queued during a `batch()` are encoded into this buffer
+        self.batch_buf = bytearray(self.BATCH_SIZE)
+        self.batch_len = 0
+        self.batch_depth = 0
+        self.batch_priority = BACKGROUND
+        # Reusable buffer for encoding single commands
+        self.cmd_buf = bytearray(16)
+        self.cmd_view = memoryview(self.cmd_buf)
+        # Latest-wins slot for drive commands (see `drive()`), which may be
+        # flushed from a helper thread once the port drains
+        self.drive_pending = None
+        self.drive_lock = threading.Lock()
+        self.flusher = None
+        # Serialises writes from the caller and the helper threads
+        self.write_lock = threading.Lock()
+        self.drive_sent = 0
+        self.drive_dropped = 0
+        # The sensors currently being streamed (None if not streaming)
+        self.stream_ids = None
+        self.paused_ids = None
+        # Background reader (see `start_reader()`)
+        self.reader = None
+        self.frames = None
+        self.frames_dropped = 0
+        self.watchdog = None
+        # Log of raw serial traffic (see `start_recording()`)
+        self.recorder = None
+        # Prioritised writer thread (see `start_writer()`)
+        self.writer = None
+        # Command-to-effect latency measurement (see `start_probe()`)
+        self.probe = None
+        # Reconnecting after the port goes away (see `enable_reconnect()`)
+        self.usb_id = None
+        self.reconnect_params = None
+        self.reconnecting = False
+        self.recovery_times = []
+        self.writes_dropped = 0
+
+    @classmethod
+    def attach(cls, port_name, serial_params, timeout=1.0, num_frames=3):
+        """Attach to a robot that is already streaming sensor data.
+
+        Listens to the stream until the sensor layout can be inferred, which
+        avoids having to pause the stream and request it again.
+
+        Returns:
+            (Controller, csp3): the controller, and a packet parser for the
+            stream, which has been fed the bytes read so far.
+        """
+        robot = cls(port_name, serial_params, reset=False)
+        data = bytearray()
+        scan = 0
+        deadline = time() + timeout
+        while time() < deadline:
+            ready, _, _ = select.select([robot.ser], [], [],
+                                      max(0, deadline - time()))
+            if ready:
+                data += robot.read(max(1, robot.ser.in_waiting))
+            sensor_ids, end = infer_layout(data, num_frames, scan)
+            if sensor_ids is not None:
+                robot.stream_ids = list(sensor_ids)
+                parser = csp3(sensor_ids)
+                parser.feed(data[end:])
+                return robot, parser
+            scan = end
+        robot.ser.close()
+        raise RuntimeError("Unable to infer stream layout from %d bytes" % len(data))
+
+    @classmethod
+    def discover(cls, serial_params, vid=None, pid=None, serial=None, reset=True):
+        """Open the robot on the port with the given USB identity.
+
+        The identity is remembered, so `reconnect()` finds the port again
+        even if the adapter comes back under a different name.
+        """
+        usb_id = {'vid': vid, 'pid': pid, 'serial': serial}
+        robot = cls(find_port(**usb_id), serial_params, reset=reset)
+        robot.usb_id = usb_id
+        return robot
 
     @staticmethod
-    def open_port(port_name, serial_params):
-        """Open a serial port for connecting to the robot."""
-        try:
-            ser = serial.Serial(port_name, **serial_params)
-            ser.setRTS(0)
-            sleep(0.25)
-            ser.setRTS(1)
-            sleep(0.25)
-            ser.flushOutput()
-            sleep(0.25)
-        except Exception as e:
-            raise(e)
+    def open_port(port_name, serial_params, reset=True):
+        """Open a serial port for connecting to the robot.
+
+        If `reset` is False, the port is opened without toggling RTS, leaving
+        a running stream undisturbed.
+        """
+        ser = serial.Serial(port_name, **serial_params)
+        if reset:
+            run_sequences([open_sequence(ser)])
         return ser 
 
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
+    @staticmethod
+    def clock():
+        """The clock used for frame timestamps."""
+        return monotonic()
+
+    def start_reader(self, parser, maxsize=64, chunk_size=4096):
+        """Start a thread that reads the stream and parses it into frames.
+
+        The thread blocks on the serial port, reads everything available into
+        a reusable buffer and passes it to `parser.feed()`. Complete frames
+        are put on `self.frames` as `(timestamp, frame)` pairs, where the
+        timestamp is the `time.monotonic()` at which they were read, so
+        computation in the main thread never delays reading the stream.
+
+        If the queue is full, the oldest frame is dropped (and counted in
+        `frames_dropped`) to make room for the newest one.
+        """
+        if self.reader is not None:
+            raise RuntimeError("Reader thread is already running")
+        self.frames = queue.Queue(maxsize)
+        self.reader_stop = threading.Event()
+        self.reader = threading.Thread(target=self._read_loop,
+                                       args=(parser, chunk_size),
+                                       daemon=True)
+        self.reader.start()
+
+    def stop_reader(self):
+        """Stop the reader thread, if it is running."""
+        if self.reader is None:
+            return
+        self.reader_stop.set()
+        self.reader.join()
+        self.reader = None
+
+    def start_watchdog(self, missed=3, on_stall=None):
+        """Stop the robot if no frames arrive for `missed` stream periods.
+
+        The watchdog is fed by the reader thread, so `start_reader()` should
+        also be called; see `watchdog.py`.
+        """
+        self.watchdog = Watchdog(self, missed=missed, on_stall=on_stall)
+        self.watchdog.start()
+        return self.watchdog
+
+    def stop_watchdog(self):
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            self.watchdog = None
+
+    def get_frame(self, timeout=None):
+        """Get the next `(timestamp, frame)` pair from the reader thread."""
+        return self.frames.get(timeout=timeout)
+
+    def _read_loop(self, parser, chunk_size):
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while not self.reader_stop.is_set():
+            fd = self.ser.fileno()
+            try:
+                ready, _, _ = select.select([fd], [], [], 0.1)
+            except OSError:
+                # let the read find out what happened to the port
+                ready = True
+            if not ready:
+                continue
+            stamp = self.read_chunk(fd, view, parser)
+            while parser.buffer:
+                self.put_frame((stamp, parser.buffer.pop(0)))
+
+    def read_chunk(self, fd, view, parser):
+        """Read what is waiting on the port into `view` and parse it.
+
+        This does everything that should happen to data read from the port,
+        for both the reader thread and `steady.SteadyLoop`: the data is
+        recorded, and if it completes any frames, the watchdog is fed and the
+        frames are checked by the actuation probe. If the port has gone away
+        and reconnecting is enabled, it is reopened (see `reconnect()`).
+
+        Returns:
+            float: the time the data arrived, or None if nothing was read.
+        """
+        try:
+            num = os.readv(fd, [view])
+            if not num:
+                # readable but empty means the device has gone away
+                raise OSError(errno.EIO, "Serial port disconnected")
+        except BlockingIOError:
+            return None
+        except OSError:
+            if self.reconnect_params is None:
+                raise
+            self.reconnect(parser)
+            return None
+        stamp = self.clock()
+        if self.recorder is not None:
+            self.recorder.record(READ, view[:num])
+        count = parser.frames_parsed
+        parser.feed(view[:num])
+        if parser.frames_parsed == count:
+            return stamp
+        if self.watchdog is not None:
+            self.watchdog.feed(stamp)
+        if self.probe is not None:
+            if parser.board is not None:
+                self.probe.observe(stamp, parser.board)
+            for frame in parser.buffer:
+                self.probe.observe(stamp, frame)
+        return stamp
+
+    def put_frame(self, item):
+        """Queue a frame, dropping the oldest one if the queue is full.
+
+        The consumer may take frames at any point in between, so neither the
+        queue being full nor it being non-empty can be relied on.
+        """
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.frames.get_nowait()
+                self.frames_dropped += 1
+            except queue.Empty:
+                pass
+
     def shutdown(self):
-        """Shutdown. Pause stream, set mode to passive, and close serial port."""
+        """Shutdown. Pause stream, set mode to passive, and close serial port.
+
+        Rather than sleeping for a fixed time, this waits for the stream to
+        stop and for the robot to report that it is in passive mode.
+
+        Raises:
+            sequence.SequenceTimeout: if the robot never confirmed passive
+            mode (the port is closed regardless).
+        """
+        self.stop_watchdog()
+        self.stop_reader()
+        self.stop_writer()
         try:
-            self.pause_stream()
-            sleep(1.5)
-            self.ser.flushOutput()
-            self.mode_passive()
-            sleep(1.5)
-        except Exception as e:
-            self.ser.flush()
-            self.ser.flushOutput()
-            self.ser.flushInput()
-            self.ser.close()
-            raise(e)
+            run_sequences([shutdown_sequence(self.ser, self.write_now,
+                                             self.read)])
         finally:
             self.ser.close()
+            self.stop_recording()
 
     def send_cmd(self, *lst):
         """Send a command (here, a list of integers) to the robot.
 
+        Inside of a `batch()`, the command is queued instead of being sent.
+
         Args:
             lst: a list of int, or other byte-sized objects.
 
         Returns:
-            int: the number of bytes sent 
+            int: the number of bytes sent (or queued)
+        """
+        if self.batch_depth:
+            end = self.batch_len + len(lst)
+            self.batch_buf[self.batch_len:end] = bytes(lst)
+            self.batch_len = end
+            if self.writer is not None:
+                self.batch_priority = min(self.batch_priority, priority_of(lst))
+            return len(lst)
+        return self.write(bytes(lst))
+
+    def send_command(self, command, *args):
+        """Encode a `commands.Command` and send it (or queue it in a batch).
+
+        Returns:
+            int: the number of bytes sent (or queued)
+        """
+        if self.batch_depth:
+            end = self.batch_len + command.size
+            if end > len(self.batch_buf):
+                self.batch_buf.extend(bytes(len(self.batch_buf)))
+            command.pack_into(self.batch_buf, self.batch_len, *args)
+            if self.writer is not None:
+                self.batch_priority = min(self.batch_priority, priority_of(
+                    self.batch_buf[self.batch_len:end]))
+            self.batch_len = end
+            return command.size
+        command.pack_into(self.cmd_buf, 0, *args)
+        return self.write(self.cmd_view[:command.size])
+
+    def write(self, data, priority=None):
+        """Write raw bytes to the serial port.
+
+        If the writer thread is running, the data is queued with the given
+        priority (by default, judged from the command; see `writequeue.py`).
+        Otherwise it is written straight away.
+        """
+        if self.writer is not None:
+            self.writer.put(data, priority)
+            return len(data)
+        return self.write_now(data)
+
+    def write_now(self, data):
+        """Write raw bytes to the serial port, bypassing the writer thread.
+
+        Note that the output buffer is not flushed afterwards, since
+        `flushOutput()` discards any bytes that have not yet been transmitted.
+        If reconnecting is enabled, writes that fail because the port has
+        gone away are dropped (and counted in `writes_dropped`).
         """
-        print(lst)
-        print(len(lst))
-        cmd = struct.pack('B'*len(lst), *lst)
         try:
-            sent = self.ser.write(cmd)
-            self.ser.flushOutput()
-        except Exception as e:
-            raise(e)
-        return sent
+            with self.write_lock:
+                if self.recorder is not None:
+                    self.recorder.record(WRITE, data)
+                return self.ser.write(data)
+        except OSError:
+            if self.reconnect_params is None:
+                raise
+            self.writes_dropped += 1
+            return 0
+
+    def read(self, size=1):
+        """Read up to `size` bytes from the serial port."""
+        data = self.ser.read(size)
+        if self.recorder is not None and data:
+            self.recorder.record(READ, data)
+        return data
+
+    def start_writer(self, chunk_size=16):
+        """Send writes through a prioritised writer thread.
+
+        Safety and control commands keep their order and go ahead of
+        background traffic (songs, scripts, LEDs), which is sent in chunks so
+        it can't hold up a stop for long, and a stop discards any drive
+        commands still queued; see `writequeue.py`.
+        """
+        if self.writer is not None:
+            raise RuntimeError("Writer thread is already running")
+        self.writer = WriteQueue(self, chunk_size=chunk_size)
+        self.writer.start()
+        return self.writer
+
+    def stop_writer(self):
+        """Write anything still queued and stop the writer thread."""
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+
+    def start_recording(self, path, block_size=1 << 16):
+        """Log all data read and written to `path` (see `recorder.py`).
+
+        Data read by the reader thread and via `read()`, and everything
+        written via `write()` (which includes all commands) is recorded.
+        """
+        self.recorder = Recorder(path, block_size=block_size)
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
+
+    @contextmanager
+    def batch(self):
+        """Queue all commands sent within the block and write them at once.
+
+        Example:
+            with robot.batch():
+                robot.set_led(...)
+                robot.set_lsd(...)
+
+        Batches can be nested, in which case everything is written when the
+        outermost block exits, along with any pending drive command. If an
+        exception is raised in the block, the queued commands are discarded.
+        """
+        self.batch_depth += 1
+        try:
+            yield self
+            if self.batch_depth == 1:
+                self.flush_drive()
+        except BaseException:
+            if self.batch_depth == 1:
+                self.batch_len = 0
+                self.batch_priority = BACKGROUND
+            raise
+        finally:
+            self.batch_depth -= 1
+        if not self.batch_depth and self.batch_len:
+            length, self.batch_len = self.batch_len, 0
+            priority, self.batch_priority = self.batch_priority, BACKGROUND
+            with memoryview(self.batch_buf) as view:
+                self.write(view[:length], priority if self.writer else None)
+            if self.probe is not None:
+                self.probe.written(self.clock())
 
     def mode_full(self):
         """Set mode to full."""
-        self.send_cmd(create.OP_FULL)
+        return self.cmd_full()
+
+    def mode_safe(self):
+        """Set mode to safe."""
+        return self.cmd_safe()
 
     def mode_passive(self):
         """Set mode to passive."""
-        return self.send_cmd(create.OP_PASSIVE)
+        return self.cmd_start()
 
     def pause_stream(self):
         """Pause the stream."""
-        return self.send_cmd(create.OP_PAUSE, 0)
+        self.paused_ids, self.stream_ids = self.stream_ids, None
+        return self.cmd_pause_resume(0)
+
+    def resume_stream(self):
+        """Resume a paused stream."""
+        self.stream_ids = self.paused_ids
+        return self.cmd_pause_resume(1)
 
     def request_stream(self, *sensor_ids):
-        """Request a stream of the sensors specified by `sensor_ids`."""
+        """Request a stream of the sensors specified by `sensor_ids`.
+
+        Warns if the stream packet will not fit in the 15 ms stream period at
+        the current baud rate; see `bandwidth.plan()` for splitting it up.
+        The check is skipped for IDs not in `packet_dct` (e.g., the group
+        packets 0-6), whose sizes aren't known.
+        """
+        known = all(i in create.packet_dct for i in sensor_ids)
+        if known and not bandwidth.fits(sensor_ids, self.baudrate):
+            warnings.warn("Stream of %d bytes overruns the link at %d baud" %
+                          (bandwidth.frame_size(sensor_ids), self.baudrate))
         length = len(sensor_ids)
-        print(sensor_ids)
+        self.stream_ids = list(sensor_ids)
         return self.send_cmd(create.OP_STREAM, length, *sensor_ids)
 
+    def reconfigure_stream(self, parser, *sensor_ids):
+        """Switch the stream to a new set of sensors without pausing it.
+
+        The parser keeps decoding packets in the old layout until the first
+        valid packet with the new layout arrives, and then switches over.
+        """
+        parser.reconfigure(sensor_ids)
+        return self.request_stream(*sensor_ids)
+
+    def drive(self, velocity, radius):
+        """Drive with `velocity` (mm/s) along an arc of `radius` (mm).
+
+        Drive commands go through a latest-wins slot: the command is written
+        immediately if nothing is waiting to be transmitted, and otherwise
+        held until the port has drained (or the end of a `batch()`),
+        replacing any older drive command that has not yet been sent. This
+        way the robot never executes stale velocities from a backlog.
+
+        Returns:
+            int: the number of bytes sent (0 if the command was held)
+        """
+        return self.set_drive(COMMANDS['drive'], velocity, radius)
+
+    def drive_direct(self, right, left):
+        """Drive with the given wheel velocities (mm/s); see `drive()`.
+
+        Setting both velocities to zero is the same as `stop()`.
+        """
+        if right == left == 0:
+            return self.stop()
+        return self.set_drive(COMMANDS['drive_direct'], right, left)
+
+    def stop(self):
+        """Stop driving.
+
+        The stop is sent straight away rather than through the latest-wins
+        slot, and discards any drive command held there. With the writer
+        thread running it is queued as a safety write, which also discards
+        the drive commands still waiting in the writer's queue.
+        """
+        with self.drive_lock:
+            if self.drive_pending is not None:
+                self.drive_dropped += 1
+            self.drive_pending = None
+        command = COMMANDS['drive_direct']
+        if self.batch_depth:
+            ret = self.send_command(command, 0, 0)
+        else:
+            command.pack_into(self.cmd_buf, 0, 0, 0)
+            ret = self.write(self.cmd_view[:command.size], SAFETY)
+        if self.probe is not None:
+            self.probe.sent(command, (0, 0),
+                            None if self.batch_depth else self.clock())
+        return ret
+
+    def enable_reconnect(self, timeout=30.0, base=0.05, cap=1.0):
+        """Reconnect automatically if the port goes away.
+
+        When reading from the port fails, the reader thread calls
+        `reconnect()`, retrying with jittered exponential backoff (see
+        `discovery.backoff_delays()`) for up to `timeout` seconds. If the
+        robot was opened with `discover()`, the port is looked up again by
+        its USB identity.
+        """
+        self.reconnect_params = {'timeout': timeout, 'base': base, 'cap': cap}
+
+    def reconnect(self, parser=None):
+        """Reopen the port, restore the stream and reset the parser.
+
+        The robot itself keeps its mode (and stream) when the adapter goes
+        away, so the port is reopened without toggling RTS. Any held drive
+        command is discarded rather than sent late.
+
+        Returns:
+            float: the time taken to recover.
+
+        Raises:
+            OSError: if the port could not be reopened within the timeout.
+        """
+        params = self.reconnect_params or {'timeout': 30.0, 'base': 0.05, 'cap': 1.0}
+        start = self.clock()
+        self.reconnecting = True
+        try:
+            try:
+                self.ser.close()
+            except OSError:
+                pass
+            for delay in backoff_delays(params['base'], params['cap']):
+                try:
+                    port_name = (find_port(**self.usb_id) if self.usb_id is not None
+                                 else self.port_name)
+                    self.ser = self.open_port(port_name, self.serial_params,
+                                              reset=False)
+                    break
+                except OSError:
+                    if self.clock() + delay - start > params['timeout']:
+                        raise
+                    sleep(delay)
+            self.port_name = port_name
+        finally:
+            self.reconnecting = False
+        with self.drive_lock:
+            self.drive_pending = None
+        if parser is not None:
+            parser.reset()
+        if self.stream_ids is not None:
+            # written directly, since this usually runs on the reader thread
+            # while the caller may be in the middle of a batch
+            ids = self.stream_ids
+            self.write_now(bytes([create.OP_STREAM, len(ids)] + ids))
+        elapsed = self.clock() - start
+        self.recovery_times.append(elapsed)
+        return elapsed
+
+    def reconnect_report(self):
+        times = self.recovery_times
+        return {'reconnects': len(times),
+                'median': statistics.median(times) if times else None,
+                'max': max(times) if times else None,
+                'writes_dropped': self.writes_dropped}
+
+    def set_drive(self, command, *args):
+        """Put a drive command in the latest-wins slot."""
+        with self.drive_lock:
+            if self.drive_pending is not None:
+                self.drive_dropped += 1
+            self.drive_pending = (command, args)
+        if self.batch_depth:
+            return 0
+        if self.writer_free():
+            return self.flush_drive()
+        self.schedule_drive_flush()
+        return 0
+
+    def schedule_drive_flush(self):
+        """Send the held drive command as soon as the port has drained."""
+        with self.drive_lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self._flush_when_free,
+                                            daemon=True)
+            self.flusher.start()
+
+    def _flush_when_free(self):
+        while True:
+            with self.drive_lock:
+                # nothing to send, or nowhere to send it (e.g., after a
+                # failed reconnect)
+                if self.drive_pending is None or not self.ser.is_open:
+                    self.flusher = None
+                    return
+            # a batch in progress will flush the slot itself when it ends
+            if not self.batch_depth and self.writer_free():
+                self.flush_drive(direct=True)
+            else:
+                sleep(self.DRIVE_POLL)
+
+    def writer_free(self):
+        """Check if all previously written bytes have been transmitted."""
+        if self.reconnecting:
+            return False
+        if self.writer is not None and self.writer.pending(CONTROL):
+            return False
+        if not self.ser.is_open:
+            # nothing can be waiting, and writing fails (or is dropped)
+            return True
+        try:
+            return self.ser.out_waiting == 0
+        except OSError:
+            if self.reconnect_params is None:
+                raise
+            return False
+
+    def flush_drive(self, direct=False):
+        """Send the pending drive command, if there is one.
+
+        Inside a `batch()` the command is added to the batch, unless `direct`
+        is set (as it is on the flusher thread, which must never touch the
+        batch buffer that the caller's thread may be filling).
+        """
+        with self.drive_lock:
+            pending, self.drive_pending = self.drive_pending, None
+        if pending is None:
+            return 0
+        command, args = pending
+        self.drive_sent += 1
+        batched = self.batch_depth and not direct
+        if batched:
+            ret = self.send_command(command, *args)
+        else:
+            # encoded into a new buffer, since this may run on the flusher
+            # thread while the caller is encoding other commands
+            ret = self.write(command.encode(*args))
+        if self.probe is not None:
+            self.probe.sent(command, args, None if batched else self.clock())
+        return ret
+
+    def start_probe(self, timeout=0.5):
+        """Measure the latency from drive commands to their effect.
+
+        The stream should include packets 39-42, and frames are checked by
+        the reader thread (or a `steady.SteadyLoop`); see `latency.py`.
+        """
+        if self.stream_ids is None or not set(PROBE_IDS) <= set(self.stream_ids):
+            warnings.warn("Stream should include packets %s to measure latency"
+                          % (PROBE_IDS,))
+        self.probe = ActuationProbe(timeout=timeout)
+        return self.probe
+
+    def set_baud(self, rate, timeout=0.5):
+        """Change the baud rate of the robot and the serial port.
+
+        After sending the baud command, waits for the robot to switch, changes
+        the port's rate and checks that the link works: if a stream is
+        running, by waiting for valid stream packets, and otherwise by
+        querying the robot's OIMode. If that fails, the robot is told to
+        switch back and the port is returned to its old rate.
+
+        Returns:
+            bool: True if the link works at the new rate.
+        """
+        if self.reader is not None:
+            raise RuntimeError("Stop the reader thread before changing baud rate")
+        if self.writer is not None:
+            # the baud command would only be queued, so the port's rate could
+            # change before it had been sent
+            raise RuntimeError("Stop the writer thread before changing baud rate")
+        if rate not in create.BAUD_CODES:
+            raise ValueError("Unsupported baud rate: %s" % rate)
+        old = self.ser.baudrate
+        self.switch_baud(rate)
+        if self.verify_link(timeout):
+            return True
+        self.switch_baud(old)
+        return False
+
+    def switch_baud(self, rate):
+        self.cmd_baud(create.BAUD_CODES[rate])
+        # wait until the command has been transmitted at the old rate
+        self.ser.flush()
+        sleep(create.BAUD_SETTLE)
+        self.ser.baudrate = rate
+        self.ser.reset_input_buffer()
+
+    def verify_link(self, timeout=0.5):
+        """Check that the robot's replies can be read at the current rate."""
+        if self.stream_ids is None:
+            self.write(bytes([create.OP_QUERY, 35]))
+        data = bytearray()
+        scan = 0
+        deadline = time() + timeout
+        while time() < deadline:
+            ready, _, _ = select.select([self.ser], [], [],
+                                      max(0, deadline - time()))
+            if ready:
+                data += self.read(max(1, self.ser.in_waiting))
+            if self.stream_ids is None:
+                # OIMode is passive, safe or full if we're talking to it
+                if data:
+                    return len(data) == 1 and 1 <= data[0] <= 3
+                continue
+            sensor_ids, scan = infer_layout(data, 2, scan)
+            if sensor_ids == self.stream_ids:
+                return True
+        return False
+
+    def upload_script(self, script):
+        """Upload a `script.Script` to the robot (see `script.py`)."""
+        return self.write(script.compile())
+
+    def play_script(self):
+        """Run the script previously uploaded to the robot."""
+        return self.cmd_play_script()
+
+    def show_script(self, timeout=0.5):
+        """Read back the script stored on the robot.
+
+        The stream should be paused (and the reader thread stopped) first.
+
+        Returns:
+            bytes: the script's commands (without the Script opcode/length).
+        """
+        self.ser.reset_input_buffer()
+        self.cmd_show_script()
+        data = bytearray()
+        deadline = time() + timeout
+        while time() < deadline and (not data or len(data) < data[0] + 1):
+            ready, _, _ = select.select([self.ser], [], [],
+                                      max(0, deadline - time()))
+            if ready:
+                data += self.read(self.ser.in_waiting or 1)
+        if not data or len(data) < data[0] + 1:
+            raise RuntimeError("Timed out reading script from robot")
+        return bytes(data[1:data[0] + 1])
+
     def run_demo(self, num):
         """Run a built-in demo.
         num : 0, 1, 2, ..., 9
         """
         ret = self.stop_demo()
-        ret += self.send_cmd(create.OP_DEMO, num)
+        ret += self.cmd_demo(num)
         return ret 
 
     def stop_demo(self):
-        return self.send_cmd(create.OP_DEMO, 255)
+        return self.cmd_demo(-1)
 
     def set_led(self, playOn=False, advOn=False, powColor=0, powIntensity=0):
         # Set up byte for the Advance and Play LEDs
         tmp = 0
-        # do these with binary operators to make them more obvious
-        if playOn: tmp += 1
-        if advOn:  tmp += 8 
-        # Limit the power LED intensities
-        powIntensity = max(0, min(powIntensity, 255))
-        powColor     = max(0, min(powColor, 255))
-        
-        # send the command
-        return self.send_cmd(OP_LEDS, tmp, powColor, powIntensity)
+        if playOn: tmp |= 2
+        if advOn:  tmp |= 8 
+        # send the command (the power LED values are clamped by the encoder)
+        return self.cmd_leds(tmp, powColor, powIntensity)
 
     def set_lsd(self, d0=False, d1=False, d2=False):
         """ Set the low side drivers to be on (True) or off (False)
@@ -115,22 +789,18 @@ class Controller:
             of 0.5 A, d2 (pin 24) has a maximum current of 1.5 """
         # Build the byte to be sent to the Create
         tmp = 0
-        if d0: tmp += 1
-        if d1: tmp += 2
-        if d2: tmp += 4
+        if d0: tmp |= 1
+        if d1: tmp |= 2
+        if d2: tmp |= 4
         
         # send the command
-        return self.send_cmd(OP_LSD, tmp)
+        return self.cmd_lsd(tmp)
 
-    def pwm_lsd(ser, pct0=0, pct1=0, pct2=0):
+    def pwm_lsd(self, pct0=0, pct1=0, pct2=0):
         """ Set up pulse-width modulation on the low side drivers by specifying
         the percentage of maximum power (w/ 7 bit resolution)."""
-        # Get the integer representation of the desired power
-        d0 = max(0, min(int(128 * pct0), 128))
-        d1 = max(0, min(int(128 * pct1), 128))
-        d2 = max(0, min(int(128 * pct2), 128))
-        # Send the command 
-        return self.send_cmd(OP_PWM_LSD, d0, d1, d2)
+        # The robot expects the duty cycles in the order d2, d1, d0
+        return self.cmd_pwm_lsd(128 * pct2, 128 * pct1, 128 * pct0)
 
     def soft_reset(self):
         """Soft reset (an undocumented function).
@@ -143,10 +813,42 @@ class Controller:
         IMPORTANT: DO NOT SEND ANY DATA WHILE BOOTLOADER IS RUNNING! 
         It takes about three (3) seconds to run the bootloader.
         """
-        try:
-            ret = self.send_cmd(create.OP_SOFT_RESET)
-        except Exception as e:
-            print(e)
-        finally:
-            sleep(3)
-        return ret 
\ No newline at end of file
+        run_sequences([soft_reset_sequence(self.ser, self.write_now)])
+        return 1
+
+
+def _command_method(command):
+    def method(self, *args):
+        return self.send_command(command, *args)
+    method.__name__ = "cmd_" + command.name
+    method.__doc__ = command.doc
+    return method
+
+# Generate a `cmd_<name>` method for each command in the opcode table
+for _command in COMMANDS.values():
+    setattr(Controller, "cmd_" + _command.name, _command_method(_command))
+
+
+def open_all(port_names, serial_params, cls=Controller):
+    """Open controllers for several robots, waking them up in parallel.
+
+    `cls` is the controller class to use (a subclass of `Controller`).
+    """
+    robots = [cls(name, serial_params, reset=False) for name in port_names]
+    run_sequences([open_sequence(robot.ser) for robot in robots])
+    return robots
+
+
+def shutdown_all(robots):
+    """Shut down several robots in parallel."""
+    for robot in robots:
+        robot.stop_watchdog()
+        robot.stop_reader()
+        robot.stop_writer()
+    try:
+        run_sequences([shutdown_sequence(robot.ser, robot.write_now, robot.read)
+                       for robot in robots])
+    finally:
+        for robot in robots:
+            robot.ser.close()
+            robot.stop_recording()
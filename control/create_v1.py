@@ -6,19 +6,42 @@ import serial
 
 # Opcodes
 OP_SOFT_RESET = 7       # The (potentially dangerous) soft reset
-OP_PASSIVE = 128        # Set the robot's mode to passive
+OP_START = 128          # Start the Open Interface
+OP_PASSIVE = 128        # Set the robot's mode to passive (same as start)
 OP_BAUD = 129           # Change the robot's baud rate
 OP_CONTROL = 130        # Set the robot's mode to "safe"
+OP_SAFE = 131           # Set the robot's mode to "safe"
 OP_FULL = 132           # Set the robot's mode to "full"
+OP_SPOT = 134           # Run the "spot" demo
+OP_COVER = 135          # Run the "cover" demo
 OP_DEMO = 136           # Request built-in demo
+OP_DRIVE      = 137     # Drive command (velocity and radius)
 OP_LSD        = 138     # Low Side Drivers
 OP_LEDS       = 139     # LEDs
+OP_SONG       = 140     # Define a song
+OP_PLAY_SONG  = 141     # Play a song
 OP_QUERY  = 142         # Request the value for a single sensor
+OP_COVER_AND_DOCK = 143 # Run the "cover and dock" demo
 OP_PWM_LSD    = 144     # Pulse width modulation, low side drivers
-OP_DRIVE      = 145     # Drive command
+OP_DRIVE_DIRECT = 145   # Drive command (velocity of each wheel)
+OP_DIGITAL_OUTPUTS = 147 # Digital outputs on the cargo bay connector
 OP_STREAM = 148         # Request a stream of sensor data from the robot
 OP_QUERY_LIST = 149     # Request the values for a list of sensors
 OP_PAUSE  = 150         # Pause (or unpause) the robot's sensor data stream
+OP_SEND_IR = 151        # Send an IR byte via the low side driver 1
+OP_SCRIPT = 152         # Define a script
+OP_PLAY_SCRIPT = 153    # Play the script
+OP_SHOW_SCRIPT = 154    # Report the script's contents
+OP_WAIT_TIME = 155      # (Script) Wait for a time (in tenths of a second)
+OP_WAIT_DISTANCE = 156  # (Script) Wait until travelled a distance (mm)
+OP_WAIT_ANGLE = 157     # (Script) Wait until turned through an angle (deg)
+OP_WAIT_EVENT = 158     # (Script) Wait for an event
+
+# Codes for each baud rate supported by the baud command (OP_BAUD)
+BAUD_CODES = {300: 0, 600: 1, 1200: 2, 2400: 3, 4800: 4, 9600: 5, 14400: 6,
+              19200: 7, 28800: 8, 38400: 9, 57600: 10, 115200: 11}
+# Time to wait after changing the baud rate before sending more commands
+BAUD_SETTLE = 0.1
 
 # The parameters for opening the serial port
 SERIAL_PARAMS = {"baudrate":    57600,
@@ -26,6 +49,82 @@ SERIAL_PARAMS = {"baudrate":    57600,
                  "parity": serial.PARITY_NONE,
                  "bytesize":serial.EIGHTBITS}
 
+# A dictionary describing the commands the robot accepts.
+# Each argument is given as (name, dtype, min, max), where the dtype is a
+# `struct` format character (arguments are big-endian), and values outside of
+# [min, max] are clamped. Commands with variable-length arguments (songs,
+# scripts, streams) have `args` set to None.
+opcode_dct = \
+{OP_SOFT_RESET: {'name': 'soft_reset', 'args': []},
+ OP_START: {'name': 'start', 'args': []},
+ OP_BAUD: {'name': 'baud', 'args': [('code', 'B', 0, 11)]},
+ OP_CONTROL: {'name': 'control', 'args': []},
+ OP_SAFE: {'name': 'safe', 'args': []},
+ OP_FULL: {'name': 'full', 'args': []},
+ OP_SPOT: {'name': 'spot', 'args': []},
+ OP_COVER: {'name': 'cover', 'args': []},
+ OP_DEMO: {'name': 'demo', 'args': [('which', 'b', -1, 9)]},
+ OP_DRIVE: {'name': 'drive',
+  'args': [('velocity', 'h', -500, 500), ('radius', 'h', -32768, 32767)]},
+ OP_LSD: {'name': 'lsd', 'args': [('bits', 'B', 0, 7)]},
+ OP_LEDS: {'name': 'leds',
+  'args': [('bits', 'B', 0, 10), ('color', 'B', 0, 255),
+           ('intensity', 'B', 0, 255)]},
+ OP_SONG: {'name': 'song', 'args': None},
+ OP_PLAY_SONG: {'name': 'play_song', 'args': [('song', 'B', 0, 15)]},
+ OP_QUERY: {'name': 'query', 'args': [('packet', 'B', 0, 42)]},
+ OP_COVER_AND_DOCK: {'name': 'cover_and_dock', 'args': []},
+ OP_PWM_LSD: {'name': 'pwm_lsd',
+  'args': [('d2', 'B', 0, 128), ('d1', 'B', 0, 128), ('d0', 'B', 0, 128)]},
+ OP_DRIVE_DIRECT: {'name': 'drive_direct',
+  'args': [('right', 'h', -500, 500), ('left', 'h', -500, 500)]},
+ OP_DIGITAL_OUTPUTS: {'name': 'digital_outputs', 'args': [('bits', 'B', 0, 7)]},
+ OP_STREAM: {'name': 'stream', 'args': None},
+ OP_QUERY_LIST: {'name': 'query_list', 'args': None},
+ OP_PAUSE: {'name': 'pause_resume', 'args': [('state', 'B', 0, 1)]},
+ OP_SEND_IR: {'name': 'send_ir', 'args': [('value', 'B', 0, 255)]},
+ OP_SCRIPT: {'name': 'script', 'args': None},
+ OP_PLAY_SCRIPT: {'name': 'play_script', 'args': []},
+ OP_SHOW_SCRIPT: {'name': 'show_script', 'args': []},
+ OP_WAIT_TIME: {'name': 'wait_time', 'args': [('time', 'B', 0, 255)]},
+ OP_WAIT_DISTANCE: {'name': 'wait_distance',
+  'args': [('distance', 'h', -32767, 32767)]},
+ OP_WAIT_ANGLE: {'name': 'wait_angle', 'args': [('angle', 'h', -32767, 32767)]},
+ OP_WAIT_EVENT: {'name': 'wait_event', 'args': [('event', 'b', -22, 22)]}}
+
+# The maximum length (in bytes) of a script
+SCRIPT_MAX_LENGTH = 100
+
+# Events for the wait event command (OP_WAIT_EVENT); negate to wait for the
+# inverse of the event (e.g., -EVENT_BUMP waits until no bumper is pressed)
+EVENT_WHEEL_DROP = 1
+EVENT_FRONT_WHEEL_DROP = 2
+EVENT_LEFT_WHEEL_DROP = 3
+EVENT_RIGHT_WHEEL_DROP = 4
+EVENT_BUMP = 5
+EVENT_LEFT_BUMP = 6
+EVENT_RIGHT_BUMP = 7
+EVENT_VIRTUAL_WALL = 8
+EVENT_WALL = 9
+EVENT_CLIFF = 10
+EVENT_LEFT_CLIFF = 11
+EVENT_FRONT_LEFT_CLIFF = 12
+EVENT_FRONT_RIGHT_CLIFF = 13
+EVENT_RIGHT_CLIFF = 14
+EVENT_HOME_BASE = 15
+EVENT_ADVANCE_BUTTON = 16
+EVENT_PLAY_BUTTON = 17
+EVENT_DIGITAL_INPUT_0 = 18
+EVENT_DIGITAL_INPUT_1 = 19
+EVENT_DIGITAL_INPUT_2 = 20
+EVENT_DIGITAL_INPUT_3 = 21
+EVENT_PASSIVE_MODE = 22
+
+# Special radius values for the drive command
+RADIUS_STRAIGHT = 32767
+RADIUS_SPIN_CW = -1
+RADIUS_SPIN_CCW = 1
+
 # A dictionary for the types of packets the robot can send
 packet_dct = \
 {7: {'ValueRange': [0, 31],
@@ -105,49 +204,49 @@ packet_dct = \
   'id': 19,
   'name': 'Distance',
   'size': 2,
-  'units': None},
- 20: {'ValueRange': [0, 5],
+  'units': 'mm'},
+ 20: {'ValueRange': [-32768, 32767],
   'dtype': 'h',
   'id': 20,
   'name': 'Angle',
   'size': 2,
-  'units': None},
+  'units': 'degrees'},
  21: {'ValueRange': [0, 5],
   'dtype': 'B',
   'id': 21,
   'name': 'ChargingState',
   'size': 1,
   'units': None},
- 22: {'ValueRange': [-32768, 32767],
+ 22: {'ValueRange': [0, 65535],
   'dtype': 'H',
   'id': 22,
   'name': 'Voltage',
   'size': 2,
-  'units': None},
+  'units': 'mV'},
  23: {'ValueRange': [-32768, 32767],
   'dtype': 'h',
   'id': 23,
   'name': 'Current',
   'size': 2,
-  'units': None},
+  'units': 'mA'},
  24: {'ValueRange': [-128, 127],
   'dtype': 'b',
   'id': 24,
   'name': 'BatteryTemperature',
   'size': 1,
-  'units': None},
+  'units': 'degC'},
  25: {'ValueRange': [0, 65535],
   'dtype': 'H',
   'id': 25,
   'name': 'BatteryCharge',
   'size': 2,
-  'units': None},
+  'units': 'mAh'},
  26: {'ValueRange': [0, 4095],
   'dtype': 'H',
   'id': 26,
   'name': 'BatteryCapacity',
   'size': 2,
-  'units': None},
+  'units': 'mAh'},
  27: {'ValueRange': [0, 4095],
   'dtype': 'H',
   'id': 27,
@@ -185,7 +284,7 @@ packet_dct = \
   'size': 1,
   'units': None},
  33: {'ValueRange': [0, 1023],
-  'dtype': 'B',
+  'dtype': 'H',
   'id': 33,
   'name': 'UserAnalogInput',
   'size': 2,
@@ -225,22 +324,44 @@ packet_dct = \
   'id': 39,
   'name': 'Velocity',
   'size': 2,
-  'units': None},
+  'units': 'mm/s'},
  40: {'ValueRange': [-32768, 32767],
   'dtype': 'h',
   'id': 40,
   'name': 'Radius',
   'size': 2,
-  'units': None},
+  'units': 'mm'},
  41: {'ValueRange': [-500, 500],
   'dtype': 'h',
   'id': 41,
   'name': 'RightVelocity',
   'size': 2,
-  'units': None},
+  'units': 'mm/s'},
  42: {'ValueRange': [-500, 500],
   'dtype': 'h',
   'id': 42,
   'name': 'LeftVelocity',
   'size': 2,
-  'units': None}}
\ No newline at end of file
+  'units': 'mm/s'}}
+
+# The meanings of the individual bits for packets that are bit fields
+bit_dct = \
+{7: {'BumpRight': 0,
+  'BumpLeft': 1,
+  'WheeldropRight': 2,
+  'WheeldropLeft': 3,
+  'WheeldropCaster': 4},
+ 14: {'LD1': 0,
+  'LD0': 1,
+  'LD2': 2,
+  'RightWheel': 3,
+  'LeftWheel': 4},
+ 18: {'Play': 0,
+  'Advance': 2},
+ 32: {'DigitalInput0': 0,
+  'DigitalInput1': 1,
+  'DigitalInput2': 2,
+  'DigitalInput3': 3,
+  'DeviceDetect': 4},
+ 34: {'InternalCharger': 0,
+  'HomeBase': 1}}
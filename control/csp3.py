@@ -9,6 +9,16 @@ Where `N` is the number of sensor bytes in the packet.
 More information can be found at iRobot's website, but contrary to the 
 documentation, the `start byte` (19) is included in the checksum calculation.
 
+If `validate` is set, the frames assembled during each call to `input()` are
+range-checked as a single batch (see `validate.py`), and each frame has its
+anomaly bitmask stored under the key `anomalies`. With `quarantine` also set,
+frames with a nonzero mask go to `quarantine` instead of `buffer`.
+
+The sensor set can be changed while streaming via `reconfigure()`: frames are
+assembled using their length byte and matched against the ID template of the
+current layout, and the parser switches to the new (precompiled) layout as
+soon as the first frame matching it passes the checksum.
+
 TODO: Better to use a list as a buffer, or implement a ring buffer? 
 """
 
@@ -18,10 +28,8 @@ import sys
 import time
 from time import sleep
 
-import numpy as np 
-import serial
-
 import create_v1 as create 
+import schema
 from create_v1 import SERIAL_PARAMS, packet_dct 
 
 
@@ -29,54 +37,161 @@ class csp3:
     WAITING = 0
     IN_MSG = 1
     FIRST_BYTE = 19
+    # Initial size of the buffer `feed()` assembles packets in
+    BUFFER_SIZE = 4096
 
-    def __init__(self, sensor_lst):
-        self.sensor_lst = sensor_lst
-        self.packet_info = [packet_dct[i] for i in sensor_lst]
-        self.names = [x['name'] for x in self.packet_info]
-        self.sizes = np.array([x['size'] for x in self.packet_info])
-        self.types = [i['dtype'] for i in self.packet_info]
-        self.data_format = ">" + "".join(self.types)
-        self.sensor_bytes = sum(self.sizes)
-        self.total_bytes = len(self.sensor_lst) + self.sensor_bytes + 3
-
-        # Determine locations in the packet that represent data
-        id_ix = np.cumsum(np.append([2], self.sizes+1))[:-1]
-        # get indices of sensor data within the packet
-        self.data_ix = [id_ix[i] + j + 1 for i, x in enumerate(self.sizes) for j in range(x)]
-
-
+    def __init__(self, sensor_lst, validate=False, quarantine=False, board=None):
         # Initialize the actual packet construction machinery
         self.buffer = []
-        self.current = []
+        # Frames parsed so far (including any quarantined or on a board)
+        self.frames_parsed = 0
+        self.current = bytearray()
+        # `feed()` parses `raw[pos:end]`
+        self.raw = bytearray(csp3.BUFFER_SIZE)
+        self.pos = 0
+        self.end = 0
         self.count = 0
         self.checksum = 0
+        self.expected = 0
         self.state = csp3.WAITING
 
+        # Range validation (frames are held in `pending` until checked)
+        self.validate = validate
+        self.quarantine_bad = quarantine
+        self.pending = []
+        self.quarantine = []
 
-    def parse(self, pkt):
-        """
-        Parse the packet, first getting the data bytes (as integers), packing
-        them, then unpacking them in the correct format.
+        # If given a `steady.StateBoard`, frames update it in place instead of
+        # being stored as dicts in `buffer`
+        if board is not None and validate:
+            raise ValueError("Range validation is not supported with a state board")
+        self.board = board
+
+        self.next_layout = None
+        self.set_layout(schema.layout(sensor_lst))
+
+    def set_layout(self, layout):
+        """Start parsing packets according to `layout`."""
+        self.layout = layout
+        self.sensor_lst = layout.sensor_lst
+        self.names = layout.names
+        self.total_bytes = layout.total_bytes
+        if self.board is not None:
+            self.board.set_layout(layout)
+        self.validator = None
+        if self.validate:
+            # imported here so that NumPy is only loaded if it is needed
+            from validate import RangeValidator
+            self.validator = RangeValidator(layout)
+
+    def reconfigure(self, sensor_lst):
+        """Prepare to switch to a new list of sensors.
+
+        Packets in the old layout continue to be parsed until the first valid
+        packet in the new layout arrives, at which point the new layout
+        replaces the old one.
         """
-        ret = np.array(pkt)[self.data_ix]
-        ret = struct.pack("B"*self.sensor_bytes, *ret)
-        ret = struct.unpack(self.data_format, ret)
-        return ret 
+        self.next_layout = schema.layout(sensor_lst)
+
+    def parse(self, pkt, offset=0):
+        """Parse the packet according to the current layout."""
+        return self.layout.parse(pkt, offset)
 
     def store(self, pkt):
         # print(pkt) # TODO: REMOVE
+        self.frames_parsed += 1
+        if self.board is not None:
+            self.board.update(pkt)
+            return
+        if self.validator is not None:
+            self.pending.append(pkt)
+            return
         dct = {k: v for k, v in zip(self.names, pkt)}
         self.buffer.append(dct)
 
+    def check_pending(self):
+        """Range-check all pending frames as a batch and store them."""
+        if not self.pending:
+            return
+        masks = self.validator.check(self.pending)
+        for pkt, mask in zip(self.pending, masks.tolist()):
+            dct = {k: v for k, v in zip(self.names, pkt)}
+            dct['anomalies'] = mask
+            if mask and self.quarantine_bad:
+                self.quarantine.append(dct)
+            else:
+                self.buffer.append(dct)
+        self.pending = []
+
     def input(self, *byte_lst):
         for b in byte_lst:
             self.input_byte(b)
-    
+        if self.validator is not None:
+            self.check_pending()
+
+    def feed(self, data):
+        """Parse a chunk of bytes (e.g., everything read from the port).
+
+        This is much faster than `input()`, since it finds whole packets using
+        the length byte and checksums them in one go, rather than stepping a
+        state machine for every byte. If a packet fails the checksum, the
+        search resumes at the next start byte, so a corrupted byte costs at
+        most one packet. Use either `feed()` or `input()`, not both.
+
+        Packets are assembled in a preallocated buffer, and checksummed and
+        unpacked in place, so nothing is copied per packet.
+        """
+        buf = self.raw
+        ix, end = self.pos, self.end
+        num = len(data)
+        if end + num > len(buf):
+            # move the unparsed bytes to the front, first growing the buffer
+            # if they wouldn't fit
+            if end - ix + num > len(buf):
+                buf.extend(bytes(end - ix + num))
+            buf[:end - ix] = buf[ix:end]
+            ix, end = 0, end - ix
+        view = memoryview(buf)
+        try:
+            view[end:end + num] = data
+            end += num
+            while True:
+                start = buf.find(csp3.FIRST_BYTE, ix, end)
+                if start < 0:
+                    ix = end
+                    break
+                if start + 1 >= end:
+                    ix = start
+                    break
+                length = buf[start+1]
+                if not self.expects(length):
+                    ix = start + 1
+                    continue
+                stop = start + length + 3
+                if stop > end:
+                    ix = start
+                    break
+                if sum(view[start:stop]) % 256 == 0 and \
+                        self.accept(buf, start, stop):
+                    ix = stop
+                else:
+                    print("Misaligned packet:", bytes(view[start:stop]))
+                    ix = start + 1
+        finally:
+            view.release()
+        self.pos, self.end = ix, end
+        if self.validator is not None:
+            self.check_pending()
+
+    def expects(self, length):
+        """Check if `length` is a valid length byte for an expected packet."""
+        if length == self.layout.length:
+            return True
+        return self.next_layout is not None and length == self.next_layout.length
+
     def input_byte(self, b):
         """Parse a single byte."""
-        if not isinstance(b, int):
-            x = ord(b) # byte to integer
+        x = b if isinstance(b, int) else ord(b) # byte to integer
         
         # determine what to do with the byte, depending on state
         if self.state == csp3.WAITING:
@@ -84,7 +199,8 @@ class csp3:
                 self.count += 1
                 self.checksum += x
                 self.state = csp3.IN_MSG
-                self.current = [x]
+                self.current = bytearray((x,))
+            return
         elif self.state == csp3.IN_MSG:
             self.count += 1
             self.checksum += x
@@ -92,23 +208,118 @@ class csp3:
         else:
             raise RuntimeError("CSP3 in unrecognized state:", self.state)
 
-        # if enough bytes have been accumulated, try to form a valid packet
-        if self.count == self.total_bytes:
-            if 0 == self.checksum % 256:
-                packet = self.parse(self.current)
-                self.store(packet)
+        # the second byte gives the length of the packet
+        if self.count == 2:
+            if self.expects(x):
+                self.expected = x + 3
             else:
+                self.reset()
+            return
+
+        # if enough bytes have been accumulated, try to form a valid packet
+        if self.count == self.expected:
+            if 0 != self.checksum % 256 or not self.accept(self.current):
                 print("Misaligned packet:", self.current)
 
             # in either case, reset and be ready to form a new packet
-            self.current = []
-            self.count = 0
-            self.checksum = 0
-            self.state = csp3.WAITING
+            self.reset()
+
+    def accept(self, pkt, start=0, stop=None):
+        """Parse and store a packet that has passed the checksum.
+
+        The packet is `pkt[start:stop]`, which is not copied.
+
+        Returns:
+            bool: False if the packet did not match the expected layout.
+        """
+        nxt = self.next_layout
+        size = (len(pkt) if stop is None else stop) - start
+        if size == self.layout.total_bytes and self.layout.matches(pkt, start):
+            pass
+        elif nxt is not None and size == nxt.total_bytes and nxt.matches(pkt, start):
+            # first packet in the new layout; store frames parsed so far
+            # before switching over
+            if self.validator is not None:
+                self.check_pending()
+            self.set_layout(nxt)
+            self.next_layout = None
+        else:
+            return False
+        self.store(self.parse(pkt, start))
+        return True
+
+    def reset(self):
+        """Discard any partially assembled packet."""
+        self.pos = 0
+        self.end = 0
+        self.current = bytearray()
+        self.count = 0
+        self.checksum = 0
+        self.expected = 0
+        self.state = csp3.WAITING
+
+
+def scan_layout(data, start):
+    """Try to read a packet's sensor IDs from `data` starting at `start`.
+
+    The IDs are found by walking the packet, skipping over the data bytes for
+    each sensor according to its size in `packet_dct`.
 
+    Returns:
+        tuple: the sensor IDs, or `None` if no valid packet starts there.
+    """
+    if data[start] != csp3.FIRST_BYTE or start + 1 >= len(data):
+        return None
+    end = start + data[start+1] + 2
+    if end >= len(data) or sum(data[start:end+1]) % 256 != 0:
+        return None
+    ids = []
+    ix = start + 2
+    while ix < end:
+        if data[ix] not in packet_dct:
+            return None
+        ids.append(data[ix])
+        ix += packet_dct[data[ix]]['size'] + 1
+    if ix != end or not ids:
+        return None
+    return tuple(ids)
 
 
+def infer_layout(data, num_frames=3, start=0):
+    """Infer the list of streamed sensors from a chunk of raw bytes.
 
+    A layout is accepted once `num_frames` consecutive valid packets with the
+    same sensor IDs have been found. When reading the stream incrementally,
+    pass back the index returned by a failed call as `start`, so that data
+    which has already been ruled out is not scanned again.
 
+    Returns:
+        (list, int): the sensor IDs and the index just past the last packet
+        used, or `(None, ix)` if the layout could not be determined, where
+        `ix` is the first index worth scanning once more data has arrived.
+    """
+    data = bytes(data)
+    for first in range(start, len(data)):
+        if not _complete(data, first):
+            return None, first
+        ids = scan_layout(data, first)
+        if ids is None:
+            continue
+        ix = first
+        count = 0
+        while _complete(data, ix) and scan_layout(data, ix) == ids:
+            ix += data[ix+1] + 3
+            count += 1
+            if count == num_frames:
+                return list(ids), ix
+        if not _complete(data, ix):
+            # the run of packets may continue in data yet to arrive
+            return None, first
+    return None, len(data)
 
 
+def _complete(data, start):
+    """Check if `data` holds a whole packet (if any) starting at `start`."""
+    if start < len(data) and data[start] != csp3.FIRST_BYTE:
+        return True
+    return start + 1 < len(data) and start + data[start+1] + 2 < len(data)
@@ -0,0 +1,91 @@
+"""
+Find the robot's serial port by USB identity rather than by device name.
+
+USB-serial adapters are numbered in the order they enumerate, so after the
+adapter is unplugged (or resets) `/dev/ttyUSB0` may come back as
+`/dev/ttyUSB1`. Instead, the port can be found by the adapter's vendor ID,
+product ID and (optionally) serial number, which are read from sysfs:
+
+    port = find_port(vid=0x0403, pid=0x6001, serial="A600eE5s")
+
+Linux only; see also `Controller.discover()` and `Controller.reconnect()`.
+"""
+import os
+import random
+
+SYSFS_TTY = "/sys/class/tty"
+
+
+def _read_attr(path, name):
+    try:
+        with open(os.path.join(path, name)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def usb_info(name):
+    """The USB identity of the tty `name` (e.g., "ttyUSB0").
+
+    Returns:
+        (vid, pid, serial): the vendor and product IDs (ints) and serial
+        number (a string, or None if the device has none), or None if the
+        tty is not a USB device.
+    """
+    path = os.path.realpath(os.path.join(SYSFS_TTY, name, "device"))
+    # walk up from the interface to the USB device that owns it
+    while path.startswith("/sys/devices/"):
+        vid = _read_attr(path, "idVendor")
+        if vid is not None:
+            pid = _read_attr(path, "idProduct")
+            return int(vid, 16), int(pid, 16), _read_attr(path, "serial")
+        path = os.path.dirname(path)
+    return None
+
+
+def find_ports(vid=None, pid=None, serial=None):
+    """List the serial ports whose USB identity matches (None matches any)."""
+    try:
+        names = sorted(os.listdir(SYSFS_TTY))
+    except FileNotFoundError:
+        return []
+    ret = []
+    for name in names:
+        info = usb_info(name)
+        if info is None:
+            continue
+        if ((vid is None or info[0] == vid) and
+                (pid is None or info[1] == pid) and
+                (serial is None or info[2] == serial)):
+            ret.append(os.path.join("/dev", name))
+    return ret
+
+
+def find_port(vid=None, pid=None, serial=None):
+    """Find the (first) serial port whose USB identity matches.
+
+    Raises:
+        FileNotFoundError: if no port matches.
+    """
+    ports = find_ports(vid, pid, serial)
+    if not ports:
+        raise FileNotFoundError("No serial port for USB device %s:%s (serial %s)"
+                                % (_hex(vid), _hex(pid), serial))
+    return ports[0]
+
+
+def _hex(x):
+    return "*" if x is None else "%04x" % x
+
+
+def backoff_delays(base=0.05, cap=1.0):
+    """Yield delays for retrying, using exponential backoff with full jitter.
+
+    The n-th delay is uniform on `[0, min(cap, base * 2**n)]`, so retries
+    start quickly (an adapter usually re-enumerates within a second) and
+    many robots reconnecting at once don't retry in lockstep.
+    """
+    ceiling = base
+    while True:
+        yield random.uniform(0, ceiling)
+        ceiling = min(cap, 2 * ceiling)
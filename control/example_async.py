@@ -0,0 +1,35 @@
+"""
+An example use of the `async_controller.py` module, reading sensor data from
+one or more robots concurrently in a single event loop.
+"""
+import asyncio
+import json
+import sys
+
+import create_v1 as create
+from async_controller import AsyncController
+
+
+async def run(port, sensor_ids):
+    print("Opening port at:", port)
+    robot = await AsyncController.open(port, create.SERIAL_PARAMS)
+    try:
+        await robot.mode_passive()
+        async for frame in robot.stream(*sensor_ids):
+            print(port, json.dumps(frame))
+    finally:
+        print("Shutting down robot and closing serial port...")
+        await robot.shutdown()
+
+
+async def main(ports, sensor_ids):
+    await asyncio.gather(*[run(port, sensor_ids) for port in ports])
+
+
+if __name__ == "__main__":
+    ports = sys.argv[1:] or ['/dev/ttyUSB0']
+    sensor_ids = [21, 22, 23, 24, 25, 26] # battery information
+    try:
+        asyncio.run(main(ports, sensor_ids))
+    except KeyboardInterrupt:
+        print('\nReceived KeyboardInterrupt, exiting')
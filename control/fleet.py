@@ -0,0 +1,294 @@
+"""
+Run a fleet of robots from a single thread on an epoll event loop.
+
+`Fleet` opens a controller for each robot and multiplexes all of their
+serial ports, their outgoing commands and any timers on one `select.epoll`,
+so a base station can run dozens of robots from one process without a
+thread (or a script) per robot. Each robot has its own stream parser, and
+decoded frames are passed to `on_frame(robot, timestamp, frame)`.
+
+Commands are never written with a blocking call: each `FleetController`
+collects what it writes in an outbox, which is written immediately if the
+port can take it and otherwise when epoll reports the port writable. Drive
+commands still go through the controller's latest-wins slot: a drive command
+is held while anything is waiting to be transmitted (in the outbox or in
+the port's own buffer), and sent from the event loop once it has drained.
+
+A robot whose port closes (or fails) is dropped from the event loop and
+moved to `lost`, and `on_lost(robot, error)` is called; the rest of the
+fleet keeps running.
+
+The work per event is bounded (one read of at most `chunk_size` bytes and
+the frames it completes), so the cost per robot is fixed by its stream rate;
+`report()` gives the time spent handling events.
+
+Example:
+    fleet = Fleet(port_names, create.SERIAL_PARAMS)
+    fleet.broadcast(lambda robot: (robot.mode_passive(), robot.mode_safe()))
+    fleet.request_stream_all(7, 19, 20)
+    fleet.on_frame = lambda robot, timestamp, frame: ...
+    fleet.call_every(1.0, lambda: print(fleet.report()))
+    try:
+        fleet.run()
+    finally:
+        fleet.shutdown()
+"""
+import heapq
+import itertools
+import os
+import select
+
+from controller import Controller, open_all, shutdown_all
+from csp3 import csp3
+from recorder import READ, WRITE
+from stats import Histogram
+
+
+class FleetController(Controller):
+    """A controller whose writes are queued for a `Fleet`'s event loop."""
+    def init_state(self):
+        super().init_state()
+        self.fleet = None
+        self.outbox = bytearray()
+        self.flush_scheduled = False
+        self.parser = None
+        self.latest = None
+        self.frames_received = 0
+
+    def write(self, data, priority=None):
+        """Write raw bytes without blocking, queueing whatever doesn't fit."""
+        if self.recorder is not None:
+            self.recorder.record(WRITE, data)
+        if self.outbox:
+            self.outbox += data
+            return len(data)
+        try:
+            num = os.write(self.ser.fileno(), data)
+        except BlockingIOError:
+            num = 0
+        if num < len(data):
+            self.outbox += data[num:]
+            if self.fleet is not None:
+                self.fleet.want_write(self)
+        return len(data)
+
+    def writer_free(self):
+        return not self.outbox and self.ser.out_waiting == 0
+
+    def schedule_drive_flush(self):
+        # once the outbox drains, `flush_outbox()` takes over; until then
+        # check again when what the port holds should have been sent
+        if self.fleet is None or self.outbox or self.flush_scheduled:
+            return
+        self.flush_scheduled = True
+        delay = self.ser.out_waiting * 10 / self.baudrate
+        self.fleet.call_later(max(delay, self.DRIVE_POLL), self._flush_when_free)
+
+    def _flush_when_free(self):
+        """Send the held drive command if the port has drained (or wait)."""
+        self.flush_scheduled = False
+        if self.fleet is None or self.drive_pending is None or self.batch_depth:
+            return
+        try:
+            if self.writer_free():
+                self.flush_drive()
+            else:
+                self.schedule_drive_flush()
+        except OSError as e:
+            self.fleet.lose(self, e)
+
+    def flush_outbox(self):
+        """Write as much of the outbox as possible.
+
+        Returns:
+            bool: True if the outbox is now empty.
+        """
+        try:
+            num = os.write(self.ser.fileno(), self.outbox)
+        except BlockingIOError:
+            return False
+        del self.outbox[:num]
+        if self.outbox:
+            return False
+        self._flush_when_free()
+        return not self.outbox
+
+
+class Fleet:
+    def __init__(self, port_names, serial_params, chunk_size=4096):
+        """
+        Args:
+            port_names: the serial ports of the robots.
+            serial_params: the serial port parameters (see `create_v1`).
+            chunk_size: the most bytes read from a port per event.
+        """
+        self.robots = open_all(port_names, serial_params, cls=FleetController)
+        self.by_fd = {}
+        self.epoll = select.epoll()
+        for robot in self.robots:
+            robot.fleet = self
+            self.by_fd[robot.ser.fileno()] = robot
+            self.epoll.register(robot.ser.fileno(), select.EPOLLIN)
+        self.buf = bytearray(chunk_size)
+        self.view = memoryview(self.buf)
+        self.timers = []
+        self.timer_seq = itertools.count()
+        self.on_frame = None
+        self.on_lost = None
+        self.lost = []
+        self.running = False
+
+        # Statistics
+        self.events = 0
+        self.handle_time = Histogram(width=0.00005)
+
+    def __len__(self):
+        return len(self.robots)
+
+    # --- Timers ------------------------------------------------------------
+
+    def call_later(self, delay, callback):
+        """Call `callback()` from the event loop after `delay` seconds."""
+        self.call_at(Controller.clock() + delay, callback)
+
+    def call_at(self, when, callback, interval=None):
+        heapq.heappush(self.timers, (when, next(self.timer_seq), callback, interval))
+
+    def call_every(self, interval, callback):
+        """Call `callback()` from the event loop every `interval` seconds."""
+        self.call_at(Controller.clock() + interval, callback, interval)
+
+    def run_timers(self, now):
+        while self.timers and self.timers[0][0] <= now:
+            when, _, callback, interval = heapq.heappop(self.timers)
+            if interval is not None:
+                self.call_at(max(when + interval, now), callback, interval)
+            callback()
+
+    # --- Streams -----------------------------------------------------------
+
+    def request_stream(self, robot, *sensor_ids):
+        """Request a stream from one robot, with a new parser for it."""
+        robot.parser = csp3(sensor_ids)
+        return robot.request_stream(*sensor_ids)
+
+    def request_stream_all(self, *sensor_ids):
+        """Request the same stream from every robot."""
+        for robot in self.robots:
+            self.request_stream(robot, *sensor_ids)
+
+    # --- Broadcasts --------------------------------------------------------
+
+    def broadcast(self, func):
+        """Call `func(robot)` for each robot, sending its commands in a batch.
+
+        Each robot's commands are written with a single write.
+        """
+        for robot in self.robots:
+            with robot.batch():
+                func(robot)
+
+    def stop_all(self):
+        """Stop every robot."""
+        self.broadcast(lambda robot: robot.stop())
+
+    def set_all_leds(self, playOn=False, advOn=False, powColor=0, powIntensity=0):
+        """Set the LEDs of every robot (see `Controller.set_led()`)."""
+        self.broadcast(lambda robot: robot.set_led(playOn, advOn, powColor,
+                                                    powIntensity))
+
+    # --- Event loop --------------------------------------------------------
+
+    def want_write(self, robot):
+        """Ask to be told when `robot`'s port can take more data."""
+        self.epoll.modify(robot.ser.fileno(), select.EPOLLIN | select.EPOLLOUT)
+
+    def stop(self):
+        """Stop the event loop (e.g., from a callback)."""
+        self.running = False
+
+    def run(self, duration=None):
+        """Run the event loop until `stop()` is called (or for `duration`)."""
+        clock = Controller.clock
+        end = None if duration is None else clock() + duration
+        self.running = True
+        while self.running:
+            now = clock()
+            if end is not None and now >= end:
+                break
+            timeout = 0.1
+            if self.timers:
+                timeout = min(timeout, self.timers[0][0] - now)
+            if end is not None:
+                timeout = min(timeout, end - now)
+            for fd, event in self.epoll.poll(max(0, timeout)):
+                start = clock()
+                robot = self.by_fd.get(fd)
+                if robot is None:
+                    continue
+                try:
+                    if event & select.EPOLLOUT and robot.flush_outbox():
+                        self.epoll.modify(fd, select.EPOLLIN)
+                    if event & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+                        self.on_readable(robot, start)
+                except OSError as e:
+                    self.lose(robot, e)
+                self.events += 1
+                self.handle_time.add(clock() - start)
+            self.run_timers(clock())
+
+    def on_readable(self, robot, stamp):
+        try:
+            num = os.readv(robot.ser.fileno(), [self.buf])
+        except BlockingIOError:
+            return
+        if not num:
+            self.lose(robot, EOFError("Port closed: %s" % robot.ser.port))
+            return
+        data = self.view[:num]
+        if robot.recorder is not None:
+            robot.recorder.record(READ, data)
+        parser = robot.parser
+        if parser is None:
+            return
+        parser.feed(data)
+        while parser.buffer:
+            frame = parser.buffer.pop(0)
+            robot.latest = (stamp, frame)
+            robot.frames_received += 1
+            if self.on_frame is not None:
+                self.on_frame(robot, stamp, frame)
+
+    def lose(self, robot, error):
+        """Drop a robot whose port has closed or failed from the event loop."""
+        fd = robot.ser.fileno()
+        self.epoll.unregister(fd)
+        del self.by_fd[fd]
+        self.robots.remove(robot)
+        robot.fleet = None
+        robot.outbox.clear()
+        self.lost.append((robot, error))
+        if self.on_lost is not None:
+            self.on_lost(robot, error)
+
+    def shutdown(self):
+        """Send anything still queued, then shut down every robot."""
+        self.running = False
+        for robot in self.robots:
+            robot.flush_drive()
+            if robot.outbox:
+                robot.ser.write(robot.outbox)
+                robot.outbox.clear()
+            self.epoll.unregister(robot.ser.fileno())
+        self.epoll.close()
+        for robot, _ in self.lost:
+            robot.ser.close()
+            robot.stop_recording()
+        shutdown_all(self.robots)
+
+    def report(self):
+        return {'robots': len(self.robots),
+                'lost': len(self.lost),
+                'events': self.events,
+                'frames': [robot.frames_received for robot in self.robots],
+                'handle_time': self.handle_time.summary()}
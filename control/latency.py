@@ -0,0 +1,104 @@
+"""
+Measure the time from sending a drive command to the robot acting on it.
+
+The robot reports the velocity and radius it was last asked for in the
+stream (packets 39 and 40 for `drive`, 41 and 42 for `drive_direct`), so
+the end-to-end actuation latency -- our side's queueing and encoding, the
+link, the robot's command processing and the wait for the next stream
+packet -- can be measured by noting when each drive command is sent and
+watching the stream for the first frame that reports its values.
+
+Usage (see `Controller.start_probe()`):
+
+    probe = robot.start_probe()
+    robot.request_stream(39, 40, 41, 42, ...)
+    robot.start_reader(parser)
+    ...
+    print(probe.report())
+
+Each command whose values differ from the previous one is tagged and
+tracked. If a frame matches a newer command before an older one was seen,
+the older ones are counted as superseded; commands not seen within
+`timeout` are counted as lost.
+"""
+import threading
+from collections import deque
+
+from commands import clamp
+from stats import Histogram
+
+# The sensors reporting the requested values for each drive command
+PROBE_IDS = (39, 40, 41, 42)
+PROBE_FIELDS = {'drive': ('Velocity', 'Radius'),
+                'drive_direct': ('RightVelocity', 'LeftVelocity')}
+
+
+class ActuationProbe:
+    def __init__(self, timeout=0.5):
+        """
+        Args:
+            timeout: how long to wait for a command to show up in the stream
+                before counting it as lost.
+        """
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # (tag, stamp, fields, values) for each command not yet seen
+        self.pending = deque()
+        self.last = None
+        self.tags = 0
+
+        # Statistics
+        self.latency = Histogram(width=0.001, num_bins=100)
+        self.matched = 0
+        self.superseded = 0
+        self.lost = 0
+
+    def sent(self, command, args, stamp):
+        """Tag a drive command sent at `stamp` (None if not yet written)."""
+        fields = PROBE_FIELDS.get(command.name)
+        if fields is None:
+            return
+        values = tuple(map(clamp, args, command.lo, command.hi))
+        if (fields, values) == self.last:
+            # the robot already reports these values
+            return
+        self.last = (fields, values)
+        self.tags += 1
+        with self.lock:
+            self.pending.append((self.tags, stamp, fields, values))
+
+    def written(self, stamp):
+        """Set the send time of commands tagged while batching."""
+        with self.lock:
+            for ix, (tag, old, fields, values) in enumerate(self.pending):
+                if old is None:
+                    self.pending[ix] = (tag, stamp, fields, values)
+
+    def observe(self, timestamp, frame):
+        """Check a frame (which arrived at `timestamp`) for tagged values."""
+        with self.lock:
+            pending = self.pending
+            if not pending:
+                return
+            for ix in range(len(pending) - 1, -1, -1):
+                _, stamp, fields, values = pending[ix]
+                if stamp is None or stamp > timestamp:
+                    continue
+                if all(frame.get(k) == v for k, v in zip(fields, values)):
+                    self.latency.add(timestamp - stamp)
+                    self.matched += 1
+                    self.superseded += ix
+                    for _ in range(ix + 1):
+                        pending.popleft()
+                    break
+            while pending and pending[0][1] is not None and \
+                    timestamp - pending[0][1] > self.timeout:
+                pending.popleft()
+                self.lost += 1
+
+    def report(self):
+        return {'tagged': self.tags,
+                'matched': self.matched,
+                'superseded': self.superseded,
+                'lost': self.lost,
+                'latency': self.latency.summary()}
@@ -0,0 +1,143 @@
+"""
+Opt-in real-time scheduling for the control loop process (Linux only).
+
+On a busy machine (e.g., a Raspberry Pi running other daemons), the Python
+control loop can be preempted for several milliseconds at a time.
+`enable_realtime()` asks the kernel to treat the process as real-time:
+
+    - the SCHED_FIFO scheduling policy, so ordinary processes can't preempt it
+    - pinning to one CPU, so it isn't migrated between cores
+    - `mlockall()`, so its memory is never paged out
+    - the real-time I/O class (or the highest best-effort I/O priority)
+
+Each of these needs privileges (root, or CAP_SYS_NICE / CAP_IPC_LOCK /
+suitable rlimits); whatever can't be applied is skipped with a warning, so
+the same code runs (just with more jitter) without them.
+
+Scheduling settings apply to the calling thread and are inherited by
+threads created afterwards, so call this before starting the reader thread.
+Running this module compares timer jitter with and without the mode:
+
+    sudo python realtime.py [seconds]
+"""
+import ctypes
+import ctypes.util
+import os
+import platform
+import warnings
+from time import monotonic, sleep
+
+from bandwidth import STREAM_PERIOD
+from stats import Histogram
+
+# Flags for mlockall()
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# ioprio_set() has no wrapper in libc (or Python), so it's called by number
+SYS_IOPRIO_SET = {'x86_64': 251, 'i386': 289, 'i686': 289,
+                  'aarch64': 30, 'armv7l': 314, 'armv6l': 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_RT = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_SHIFT = 13
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+def set_fifo(priority=50):
+    """Use the SCHED_FIFO policy with the given priority (1-99)."""
+    os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+
+
+def pin_cpu(cpus=None):
+    """Pin to `cpus` (by default, the highest-numbered allowed CPU)."""
+    if cpus is None:
+        cpus = {max(os.sched_getaffinity(0))}
+    os.sched_setaffinity(0, cpus)
+    return cpus
+
+
+def lock_memory():
+    """Lock all current and future pages into memory."""
+    if _libc().mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def set_io_priority(ioclass=IOPRIO_CLASS_RT, level=0):
+    """Set the I/O scheduling class and level (0 is highest) of the process."""
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if number is None:
+        raise OSError("ioprio_set is not known on %s" % platform.machine())
+    value = (ioclass << IOPRIO_CLASS_SHIFT) | level
+    if _libc().syscall(number, IOPRIO_WHO_PROCESS, 0, value) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def enable_realtime(priority=50, cpus=None, memory=True, io=True):
+    """Apply as much of the real-time configuration as privileges allow.
+
+    Args:
+        priority: the SCHED_FIFO priority (1-99), or None to skip it.
+        cpus: the set of CPUs to pin to (by default, one), or False to skip.
+        memory: whether to lock memory.
+        io: whether to raise the I/O priority.
+
+    Returns:
+        dict: for each setting, True if applied, or the reason it wasn't.
+    """
+    ret = {}
+
+    def attempt(name, func, *args):
+        try:
+            func(*args)
+            ret[name] = True
+        except (OSError, AttributeError) as e:
+            ret[name] = str(e)
+
+    if priority is not None:
+        attempt('sched_fifo', set_fifo, priority)
+    if cpus is not False:
+        attempt('affinity', pin_cpu, cpus)
+    if memory:
+        attempt('mlockall', lock_memory)
+    if io:
+        attempt('io_priority', set_io_priority, IOPRIO_CLASS_RT)
+        if ret['io_priority'] is not True:
+            # the best-effort class doesn't need privileges
+            attempt('io_priority', set_io_priority, IOPRIO_CLASS_BE)
+    failed = {k: v for k, v in ret.items() if v is not True}
+    if failed:
+        warnings.warn("Real-time mode only partly applied: %s" %
+                      ", ".join("%s (%s)" % x for x in failed.items()))
+    return ret
+
+
+def measure_jitter(duration=5.0, period=STREAM_PERIOD):
+    """Measure how late a periodic timer wakes up.
+
+    Returns:
+        Histogram: the lateness of each wakeup.
+    """
+    hist = Histogram(width=0.00005, num_bins=200)
+    deadline = monotonic() + period
+    end = monotonic() + duration
+    while deadline < end:
+        delay = deadline - monotonic()
+        if delay > 0:
+            sleep(delay)
+        hist.add(monotonic() - deadline)
+        deadline += period
+    return hist
+
+
+if __name__ == "__main__":
+    import sys
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    print("Without real-time mode:", measure_jitter(duration).summary())
+    print("Applied:", enable_realtime())
+    print("With real-time mode:   ", measure_jitter(duration).summary())
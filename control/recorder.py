@@ -0,0 +1,90 @@
+"""
+A compact binary log of the raw bytes sent to and received from the robot.
+
+The log starts with the magic bytes `MAGIC`, followed by records of the form:
+
+    <timestamp: uint64> <direction: uint8> <length: uint16> <data>
+
+(little-endian), where the timestamp is `time.monotonic_ns()` and the
+direction is `READ` or `WRITE`.
+
+Records are appended to an in-memory buffer, and full blocks are handed to a
+background thread for writing, so recording never waits on disk (e.g., SD
+card) I/O. Use `read_log()` to iterate over the records of a log.
+"""
+import queue
+import struct
+import threading
+from time import monotonic_ns
+
+
+MAGIC = b"IRLOG1\n"
+RECORD = struct.Struct("<QBH")
+READ = 0
+WRITE = 1
+
+
+class Recorder:
+    def __init__(self, path, block_size=1 << 16):
+        self.path = path
+        self.block_size = block_size
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.buf = bytearray()
+        self.lock = threading.Lock()
+        self.blocks = queue.Queue()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def record(self, direction, data, timestamp=None):
+        """Append a record for `data` read from or written to the port."""
+        if timestamp is None:
+            timestamp = monotonic_ns()
+        with self.lock:
+            buf = self.buf
+            for ix in range(0, len(data), 0xffff):
+                chunk = data[ix:ix + 0xffff]
+                buf += RECORD.pack(timestamp, direction, len(chunk))
+                buf += chunk
+            if len(buf) >= self.block_size:
+                self.blocks.put(buf)
+                self.buf = bytearray()
+
+    def flush(self):
+        """Hand whatever has been buffered so far to the writer thread."""
+        with self.lock:
+            if self.buf:
+                self.blocks.put(self.buf)
+                self.buf = bytearray()
+
+    def close(self):
+        """Write out any buffered records and close the log."""
+        self.flush()
+        self.blocks.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def _write_loop(self):
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                break
+            self.file.write(block)
+            self.file.flush()
+
+
+def read_log(path):
+    """Iterate over `(timestamp, direction, data)` for each record in a log."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a serial log" % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            timestamp, direction, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            yield timestamp, direction, data
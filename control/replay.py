@@ -0,0 +1,147 @@
+"""
+Replay recorded serial logs (see `recorder.py`) through csp3 and agents.
+
+`ReplayController` has the same interface as a live `Controller` stream
+(`start_reader()`, `get_frame()`, `batch()`, the command methods, ...), so a
+`scheduler.ControlLoop` or `agent.AgentRunner` can be run against production
+data without a robot. Commands sent during a replay are collected in `sent`
+rather than written anywhere.
+
+Replay can run in real time (`speed=1`), scaled (e.g., `speed=10` for ten
+times faster) or as fast as possible (`speed=None`). Timestamps are virtual:
+each frame is stamped with the time its bytes were recorded, and `clock()`
+follows the log rather than the wall clock, so results are deterministic.
+When the log runs out, `get_frame()` raises `EOFError`.
+
+For regression-checking parser changes, `parse_log()` runs a parser over a
+log and yields every frame it produces.
+"""
+import queue
+from time import monotonic, sleep
+
+from controller import Controller
+from recorder import READ, WRITE, read_log
+
+
+def parse_log(path, parser):
+    """Yield `(timestamp, frame)` for each frame `parser` finds in a log."""
+    for timestamp, direction, data in read_log(path):
+        if direction != READ:
+            continue
+        parser.feed(data)
+        while parser.buffer:
+            yield timestamp / 1e9, parser.buffer.pop(0)
+
+
+def recorded_commands(path):
+    """Yield `(timestamp, data)` for each write recorded in a log."""
+    for timestamp, direction, data in read_log(path):
+        if direction == WRITE:
+            yield timestamp / 1e9, data
+
+
+class DueFrames:
+    """Frames that have already "arrived" at the current replay time.
+
+    Stands in for the live controller's frame queue, so that a control loop
+    which falls behind during a paced replay sees a backlog.
+    """
+    def __init__(self, replay):
+        self.replay = replay
+
+    def get_nowait(self):
+        replay = self.replay
+        if replay.speed is None or not replay.peek():
+            raise queue.Empty
+        if replay.upcoming[0][0] > replay.clock():
+            raise queue.Empty
+        return replay.upcoming.pop(0)
+
+    def qsize(self):
+        return len(self.replay.upcoming)
+
+
+class ReplayController(Controller):
+    def __init__(self, path, speed=1.0, baudrate=57600):
+        """
+        Args:
+            path: the log to replay.
+            speed: the replay speed relative to real time, or `None` to
+                replay as fast as possible.
+            baudrate: the baud rate to assume for bandwidth checks.
+        """
+        self.ser = None
+        self.init_state()
+        self.path = path
+        self.speed = speed
+        self._baudrate = baudrate
+        self.records = None
+        self.parser = None
+        self.upcoming = []
+        self.sent = []
+        # Virtual time (log time at `start_real`)
+        self.start_virtual = None
+        self.start_real = None
+        self.now = None
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    def clock(self):
+        """The current replay time (in the log's timebase, in seconds)."""
+        if self.speed is None or self.start_real is None:
+            return self.now if self.now is not None else 0.0
+        return self.start_virtual + (monotonic() - self.start_real) * self.speed
+
+    def write(self, data, priority=None):
+        self.sent.append((self.clock(), bytes(data)))
+        return len(data)
+
+    def read(self, size=1):
+        return b""
+
+    def writer_free(self):
+        return True
+
+    def start_reader(self, parser, maxsize=None, chunk_size=None):
+        """Start replaying the log through `parser`."""
+        self.parser = parser
+        self.records = (r for r in read_log(self.path) if r[1] == READ)
+        self.upcoming = []
+        self.frames = DueFrames(self)
+        self.reader = True
+
+    def stop_reader(self):
+        self.reader = None
+
+    def peek(self):
+        """Make sure the next frame (if any) is in `upcoming`."""
+        while not self.upcoming:
+            try:
+                timestamp, _, data = next(self.records)
+            except StopIteration:
+                return False
+            self.parser.feed(data)
+            while self.parser.buffer:
+                self.upcoming.append((timestamp / 1e9, self.parser.buffer.pop(0)))
+        return True
+
+    def get_frame(self, timeout=None):
+        """Get the next `(timestamp, frame)`, waiting until it is due."""
+        if not self.peek():
+            raise EOFError("End of log: %s" % self.path)
+        timestamp, frame = self.upcoming.pop(0)
+        if self.speed is None:
+            self.now = timestamp
+        elif self.start_real is None:
+            self.start_virtual = timestamp
+            self.start_real = monotonic()
+        else:
+            delay = (timestamp - self.clock()) / self.speed
+            if delay > 0:
+                sleep(delay)
+        return timestamp, frame
+
+    def shutdown(self):
+        self.stop_reader()
@@ -0,0 +1,120 @@
+"""
+A control loop synchronised with the robot's sensor stream.
+
+Instead of looping on `select()` with no notion of time, `ControlLoop` runs
+a step function once for every `every` frames received from the stream, with
+a deadline for each tick. Frames are read in the background by the
+controller's reader thread, so their timestamps reflect when they arrived.
+
+Commands sent during a step are written in a single batch at the end of the
+tick (along with the latest drive command, if any).
+If the controller has a watchdog running and the stream stalls, `run()`
+raises the `watchdog.StreamStall` (the watchdog will already have stopped
+the robot).
+
+If a step takes too long and frames pile up, the loop does not try to work
+through the backlog (which would leave it progressively further behind the
+stream); depending on `overload`, it either skips the stale ticks and passes
+only the latest frames to the step function ("skip"), or passes the whole
+backlog to a single call ("compress").
+
+Example:
+    def step(frames):
+        timestamp, frame = frames[-1]
+        ...
+
+    loop = ControlLoop(robot, csp3(sensor_ids), step)
+    robot.request_stream(*sensor_ids)
+    loop.run()
+"""
+import queue
+
+from bandwidth import STREAM_PERIOD
+from stats import Histogram
+
+
+class ControlLoop:
+    def __init__(self, robot, parser, step, every=1, deadline=None,
+                 overload='skip'):
+        """
+        Args:
+            robot: the `Controller` for the robot.
+            parser: the `csp3` parser for the stream.
+            step: a function called with the list of `(timestamp, frame)`
+                pairs received since the last tick.
+            every: the number of frames per tick.
+            deadline: the time (after the last frame of the tick arrives) by
+                which the step should finish. Defaults to one tick.
+            overload: either "skip" or "compress".
+        """
+        if overload not in ('skip', 'compress'):
+            raise ValueError("Unknown overload policy: %s" % overload)
+        self.robot = robot
+        self.parser = parser
+        self.step = step
+        self.every = every
+        self.deadline = deadline if deadline is not None else every * STREAM_PERIOD
+        self.overload = overload
+        self.running = False
+
+        # Statistics
+        self.ticks = 0
+        self.misses = 0
+        self.skipped = 0
+        self.exec_time = Histogram()
+        self.lateness = Histogram()
+
+    def stop(self):
+        """Stop the loop (e.g., from within the step function)."""
+        self.running = False
+
+    def run(self, max_ticks=None):
+        """Run the loop until `stop()` is called or `max_ticks` have run."""
+        if self.robot.reader is None:
+            self.robot.start_reader(self.parser)
+        pending = []
+        self.running = True
+        while self.running and (max_ticks is None or self.ticks < max_ticks):
+            try:
+                pending.append(self.robot.get_frame(timeout=self.deadline))
+            except EOFError:
+                # end of a replayed log
+                break
+            except queue.Empty:
+                watchdog = self.robot.watchdog
+                if watchdog is not None and watchdog.stalled:
+                    raise watchdog.stall
+                continue
+            # take whatever else has already arrived
+            while True:
+                try:
+                    pending.append(self.robot.frames.get_nowait())
+                except queue.Empty:
+                    break
+            if len(pending) < self.every:
+                continue
+            if len(pending) >= 2 * self.every and self.overload == 'skip':
+                self.skipped += len(pending) // self.every - 1
+                pending = pending[-self.every:]
+            self.tick(pending)
+            pending = []
+
+    def tick(self, frames):
+        clock = self.robot.clock
+        start = clock()
+        with self.robot.batch():
+            self.step(frames)
+        end = clock()
+        self.ticks += 1
+        self.exec_time.add(end - start)
+        self.lateness.add(start - frames[-1][0])
+        if end > frames[-1][0] + self.deadline:
+            self.misses += 1
+
+    def report(self):
+        """Summarise the loop's timing."""
+        return {'ticks': self.ticks,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'exec_time': self.exec_time.summary(),
+                'lateness': self.lateness.summary()}
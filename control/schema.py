@@ -0,0 +1,148 @@
+"""
+Compiled sensor schemas for the iRobot Create.
+
+The packet table in `create_v1.py` (`packet_dct` and `bit_dct`) is the single
+source of truth; `create_v1_packets.json` is exported from it by running this
+module as a script.
+
+Each profile is compiled once into per-packet entries (struct format, NumPy
+dtype, value range, unit scale and bit layout), and stream layouts for a
+particular list of sensors are compiled from those into byte offsets and a
+single precompiled `struct.Struct` that unpacks a whole packet.
+Compiled schemas and layouts are kept in an in-process registry, so that
+building parsers (e.g., when reconfiguring the stream) does no work beyond
+a dictionary lookup once a layout has been seen.
+"""
+import json
+import math
+import os
+import struct
+from collections import namedtuple
+
+import create_v1
+
+
+# Source tables for each profile
+PROFILES = {'create_v1': (create_v1.packet_dct, create_v1.bit_dct)}
+
+# Factors for converting to SI units
+UNIT_SCALES = {None: 1.0,
+               'mm': 1e-3,
+               'mm/s': 1e-3,
+               'mV': 1e-3,
+               'mA': 1e-3,
+               'mAh': 1e-3,
+               'degC': 1.0,
+               'degrees': math.pi / 180}
+
+# NumPy equivalents of the struct format characters (big-endian)
+NP_DTYPES = {'B': 'u1', 'b': 'i1', 'H': '>u2', 'h': '>i2'}
+
+
+Packet = namedtuple('Packet', ['id', 'name', 'size', 'fmt', 'np_dtype', 'lo',
+                               'hi', 'units', 'scale', 'bits'])
+
+
+class StreamLayout:
+    """The compiled byte layout of a stream packet for a list of sensors."""
+    def __init__(self, packets):
+        self.sensor_lst = [p.id for p in packets]
+        self.names = [p.name for p in packets]
+        self.sizes = [p.size for p in packets]
+        self.types = [p.fmt for p in packets]
+        self.lo = [p.lo for p in packets]
+        self.hi = [p.hi for p in packets]
+        self.scales = [p.scale for p in packets]
+        self.sensor_bytes = sum(self.sizes)
+        # The value of the length byte `N` for packets with this layout
+        self.length = len(self.sensor_lst) + self.sensor_bytes
+        self.total_bytes = self.length + 3
+
+        # Offsets of the sensor IDs and of the sensor data within the packet
+        self.id_ix = []
+        self.data_offsets = []
+        ix = 2
+        for size in self.sizes:
+            self.id_ix.append(ix)
+            self.data_offsets.append(ix + 1)
+            ix += size + 1
+
+        # Skip the header and ID bytes, unpack everything else in one call
+        self.format = ">2x" + "".join("x" + t for t in self.types)
+        self.np_dtype = {'names': self.names,
+                         'formats': [p.np_dtype for p in packets],
+                         'offsets': self.data_offsets,
+                         'itemsize': self.total_bytes}
+        self.struct = struct.Struct(self.format)
+        self.id_pairs = tuple(zip(self.id_ix, self.sensor_lst))
+
+    def matches(self, pkt, offset=0):
+        """Check that the sensor IDs in `pkt` are the ones for this layout."""
+        for i, x in self.id_pairs:
+            if pkt[offset + i] != x:
+                return False
+        return True
+
+    def parse(self, pkt, offset=0):
+        """Unpack the sensor values from a complete packet."""
+        return self.struct.unpack_from(pkt, offset)
+
+
+class Schema:
+    def __init__(self, name, packets):
+        self.name = name
+        self.packets = packets
+        self.layouts = {}
+
+    def layout(self, sensor_lst):
+        """Get the compiled layout for a stream of `sensor_lst`."""
+        key = tuple(sensor_lst)
+        if key not in self.layouts:
+            self.layouts[key] = StreamLayout([self.packets[i] for i in key])
+        return self.layouts[key]
+
+
+def compile_profile(name):
+    """Compile the packet table for the profile `name` into a `Schema`."""
+    packet_dct, bit_dct = PROFILES[name]
+    packets = {}
+    for k, v in packet_dct.items():
+        packets[k] = Packet(id=k,
+                            name=v['name'],
+                            size=v['size'],
+                            fmt=v['dtype'],
+                            np_dtype=NP_DTYPES[v['dtype']],
+                            lo=v['ValueRange'][0],
+                            hi=v['ValueRange'][1],
+                            units=v['units'],
+                            scale=UNIT_SCALES[v['units']],
+                            bits=bit_dct.get(k, {}))
+    return Schema(name, packets)
+
+
+_registry = {}
+
+def load(name='create_v1'):
+    """Get the compiled schema for a profile (compiled on first use)."""
+    if name not in _registry:
+        _registry[name] = compile_profile(name)
+    return _registry[name]
+
+
+def layout(sensor_lst, name='create_v1'):
+    """Get the compiled layout for `sensor_lst` in the profile `name`."""
+    return load(name).layout(sensor_lst)
+
+
+def export_json(path, name='create_v1'):
+    """Write the packet table for a profile out as JSON."""
+    packet_dct, _ = PROFILES[name]
+    with open(path, 'w') as f:
+        json.dump({str(k): v for k, v in packet_dct.items()}, f,
+                  indent=4, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    export_json(os.path.join(here, "create_v1_packets.json"))
@@ -0,0 +1,86 @@
+"""
+Scripts that run on the robot itself (opcodes 152-158).
+
+A `Script` compiles a sequence of commands (including the script-only wait
+commands) into a single Script command, which is uploaded once and then run
+with `Controller.play_script()`. The robot executes it with its own timing,
+with no per-step round trips over the serial link, which makes it suitable
+for choreographed moves.
+
+Example:
+    script = Script().forward(-100).turn(90)
+    robot.mode_full()
+    robot.upload_script(script)
+    robot.play_script()
+
+Note that the robot ignores most other commands while a script is running,
+and scripts cannot be longer than 100 bytes.
+"""
+import create_v1 as create
+from commands import COMMANDS
+
+
+class Script:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def add(self, name, *args):
+        """Append the command called `name` (see `create_v1.opcode_dct`)."""
+        self.buf += COMMANDS[name].encode(*args)
+        return self
+
+    def drive(self, velocity, radius):
+        return self.add('drive', velocity, radius)
+
+    def drive_direct(self, right, left):
+        return self.add('drive_direct', right, left)
+
+    def stop(self):
+        return self.add('drive_direct', 0, 0)
+
+    def wait_time(self, seconds):
+        """Wait for `seconds` (with a resolution of 0.1 s, at most 25.5 s)."""
+        return self.add('wait_time', round(seconds * 10))
+
+    def wait_distance(self, distance):
+        """Wait until the robot has travelled `distance` mm (negative if
+        driving backwards)."""
+        return self.add('wait_distance', distance)
+
+    def wait_angle(self, angle):
+        """Wait until the robot has turned through `angle` degrees
+        (counter-clockwise is positive)."""
+        return self.add('wait_angle', angle)
+
+    def wait_event(self, event):
+        """Wait for one of the `create_v1.EVENT_*` events."""
+        return self.add('wait_event', event)
+
+    def forward(self, distance, speed=200):
+        """Drive straight for `distance` mm (backwards if negative), then stop."""
+        velocity = abs(speed) if distance >= 0 else -abs(speed)
+        return (self.drive(velocity, create.RADIUS_STRAIGHT)
+                    .wait_distance(distance)
+                    .stop())
+
+    def turn(self, angle, speed=100):
+        """Turn in place by `angle` degrees (counter-clockwise if positive),
+        then stop."""
+        radius = create.RADIUS_SPIN_CCW if angle >= 0 else create.RADIUS_SPIN_CW
+        return (self.drive(abs(speed), radius)
+                    .wait_angle(angle)
+                    .stop())
+
+    def compile(self):
+        """Encode the Script command that defines this script.
+
+        Raises:
+            ValueError: if the script is too long.
+        """
+        if len(self.buf) > create.SCRIPT_MAX_LENGTH:
+            raise ValueError("Script is %d bytes (at most %d are allowed)" %
+                             (len(self.buf), create.SCRIPT_MAX_LENGTH))
+        return bytes([create.OP_SCRIPT, len(self.buf)]) + bytes(self.buf)
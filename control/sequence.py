@@ -0,0 +1,204 @@
+"""
+Non-blocking sequences for opening, shutting down and resetting the robot.
+
+Each sequence is a state machine made of steps of the form
+`(action, condition, timeout)`: the action is run, and then the sequence
+waits until either `condition(now)` returns True or `timeout` seconds have
+passed. Steps without a condition are fixed delays.
+Sequences are advanced by calling `poll()`, which never sleeps, so many of
+them can be driven in parallel (e.g., to bring up a fleet of robots) using
+`run_sequences()`.
+
+Where the robot gives some indication of being ready, the sequences wait for
+that rather than a fixed delay: shutting down waits for the stream to go
+quiet after pausing it, and for the OIMode reported by the robot to become
+passive. If a condition is still not met when its step times out, the
+sequence carries on (so that, e.g., the port is still closed), but finishes
+with a `SequenceTimeout` error.
+"""
+import errno
+import select
+from time import time
+
+import create_v1 as create
+
+
+class SequenceTimeout(TimeoutError):
+    """A step's condition was not met before its timeout."""
+    def __init__(self, sequence, steps):
+        self.sequence = sequence
+        self.steps = steps
+        super().__init__("Sequence %r timed out waiting at step(s) %s" %
+                         (sequence.name, ", ".join(map(str, steps))))
+
+
+class Sequence:
+    # How often to check conditions when no input arrives
+    POLL_INTERVAL = 0.005
+
+    def __init__(self, ser, steps, name=""):
+        self.ser = ser
+        self.steps = list(steps)
+        self.name = name
+        self.index = 0
+        self.deadline = None
+        self.error = None
+        # Indices of the steps whose condition timed out
+        self.timed_out = []
+
+    @property
+    def done(self):
+        return self.error is not None or self.index >= len(self.steps)
+
+    @property
+    def waiting_on_input(self):
+        """True if the current step is waiting for data from the robot."""
+        return not self.done and self.steps[self.index][1] is not None
+
+    def poll(self, now=None):
+        """Advance the sequence as far as possible without blocking.
+
+        Returns:
+            float: the time at which the sequence should next be polled, or
+            `None` if it has finished.
+        """
+        now = time() if now is None else now
+        try:
+            while self.index < len(self.steps):
+                action, condition, timeout = self.steps[self.index]
+                if self.deadline is None:
+                    if action is not None:
+                        action()
+                    self.deadline = now + timeout
+                if condition is not None and condition(now):
+                    pass
+                elif now < self.deadline:
+                    if condition is None:
+                        return self.deadline
+                    return min(self.deadline, now + self.POLL_INTERVAL)
+                elif condition is not None:
+                    self.timed_out.append(self.index)
+                self.index += 1
+                self.deadline = None
+            if self.timed_out:
+                self.error = SequenceTimeout(self, self.timed_out)
+        except Exception as e:
+            self.error = e
+        return None
+
+
+def run_sequences(sequences):
+    """Run several sequences in parallel until they have all finished.
+
+    Raises:
+        the first error encountered by any of the sequences, after all of
+        them have finished.
+    """
+    sequences = list(sequences)
+    pending = {seq: 0.0 for seq in sequences}
+    while pending:
+        now = time()
+        for seq, wake in list(pending.items()):
+            if wake <= now or seq.waiting_on_input:
+                wake = seq.poll(now)
+                if wake is None:
+                    del pending[seq]
+                    continue
+                pending[seq] = wake
+        if not pending:
+            break
+        timeout = max(0, min(pending.values()) - time())
+        fds = [seq.ser for seq in pending if seq.waiting_on_input]
+        if fds:
+            select.select(fds, [], [], timeout)
+        else:
+            select.select([], [], [], timeout)
+    for seq in sequences:
+        if seq.error is not None:
+            raise seq.error
+
+
+class StreamIdle:
+    """Condition that holds once no bytes have arrived for `quiet` seconds.
+
+    Incoming bytes are drained with `read` (by default, `ser.read`).
+    """
+    def __init__(self, ser, quiet=0.03, read=None):
+        self.ser = ser
+        self.quiet = quiet
+        self.read = ser.read if read is None else read
+        self.last = None
+
+    def __call__(self, now):
+        if self.last is None:
+            self.last = now
+        if self.ser.in_waiting:
+            self.read(self.ser.in_waiting)
+            self.last = now
+        return now - self.last >= self.quiet
+
+
+class ModeIs:
+    """Condition that holds once a queried OIMode reply equals `mode`."""
+    def __init__(self, ser, mode, read=None):
+        self.ser = ser
+        self.mode = mode
+        self.read = ser.read if read is None else read
+
+    def __call__(self, now):
+        if not self.ser.in_waiting:
+            return False
+        reply = self.read(self.ser.in_waiting)
+        return reply[-1] == self.mode
+
+
+# The value of the OIMode sensor in each mode
+MODE_OFF, MODE_PASSIVE, MODE_SAFE, MODE_FULL = range(4)
+
+
+def set_rts(ser, level):
+    """Set the RTS line, ignoring ports that have none (e.g., a pty)."""
+    try:
+        ser.setRTS(level)
+    except OSError as e:
+        if e.errno not in (errno.ENOTTY, errno.EINVAL):
+            raise
+
+
+def open_sequence(ser):
+    """Toggle RTS to wake the robot after opening its port."""
+    return Sequence(ser, [
+        (lambda: set_rts(ser, 0), None, 0.25),
+        (lambda: set_rts(ser, 1), None, 0.25),
+        (ser.reset_input_buffer, None, 0.25),
+    ], name="open")
+
+
+def shutdown_sequence(ser, write=None, read=None):
+    """Pause the stream, set mode to passive and close the serial port.
+
+    Bytes are sent with `write` and received with `read` (by default, the
+    port's own methods), so that a controller can record them.
+    """
+    write = ser.write if write is None else write
+    read = ser.read if read is None else read
+
+    def query_mode():
+        # drain anything left over, so the reply is the last byte read
+        if ser.in_waiting:
+            read(ser.in_waiting)
+        write(bytes([create.OP_PASSIVE, create.OP_QUERY, 35]))
+
+    return Sequence(ser, [
+        (lambda: write(bytes([create.OP_PAUSE, 0])), StreamIdle(ser, read=read), 1.5),
+        (query_mode, ModeIs(ser, MODE_PASSIVE, read=read), 1.5),
+        (ser.close, None, 0),
+    ], name="shutdown")
+
+
+def soft_reset_sequence(ser, write=None):
+    """Soft reset, then wait for the bootloader (about three seconds)."""
+    write = ser.write if write is None else write
+    return Sequence(ser, [
+        (lambda: write(bytes([create.OP_SOFT_RESET])), None, 3),
+    ], name="soft_reset")
@@ -0,0 +1,287 @@
+"""
+A virtual iRobot Create (v1) on a pseudo-terminal, for testing without a robot.
+
+Each `VirtualCreate` opens a pty pair and implements the Open Interface on
+the master side: modes, stream/pause/query, drive commands, LEDs, low side
+drivers, songs and scripts (which are stored but not executed). Stream
+packets are sent every 15 ms on a fixed schedule. Point a `Controller` at
+`port_name` and it works unmodified (ptys have no RTS line, which the open
+sequence tolerates).
+
+A `Simulator` runs any number of virtual robots from a single thread, so
+dozens of them can be load-tested on one machine:
+
+    sim = Simulator(50)
+    sim.start()
+    robots = open_all([r.port_name for r in sim.robots], create.SERIAL_PARAMS)
+
+Sensor values can be set through `VirtualCreate.sensors` (e.g., to simulate
+a bump); distance and angle are integrated from the drive commands and, as
+on the real robot, reset each time they are reported. The link runs as fast
+as the pty allows; the baud rate is not emulated.
+"""
+import math
+import os
+import selectors
+import struct
+import threading
+import tty
+from time import monotonic
+
+import create_v1 as create
+from bandwidth import STREAM_PERIOD
+from commands import command_size
+from create_v1 import packet_dct
+
+
+# Distance between the wheels (mm)
+WHEEL_BASE = 258
+
+# Sensor values reported by a freshly started robot
+DEFAULT_SENSORS = {21: 0,       # not charging
+                   22: 16000,   # voltage (mV)
+                   23: -200,    # current (mA)
+                   24: 25,      # battery temperature (degC)
+                   25: 2500,    # charge (mAh)
+                   26: 2700}    # capacity (mAh)
+
+PACKERS = {k: struct.Struct(">" + v['dtype']) for k, v in packet_dct.items()}
+
+
+class VirtualCreate:
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port_name = os.ttyname(self.slave)
+        self.inbox = bytearray()
+
+        self.mode = 0
+        self.stream_ids = []
+        self.streaming = False
+        self.baud_code = create.BAUD_CODES[57600]
+        self.velocity = 0
+        self.radius = 0
+        self.right = 0
+        self.left = 0
+        self.leds = (0, 0, 0)
+        self.lsd = 0
+        self.pwm_lsd = (0, 0, 0)
+        self.digital_outputs = 0
+        self.songs = {}
+        self.song_number = 0
+        self.script = b""
+        self.distance = 0.0
+        self.angle = 0.0
+        self.sensors = dict(DEFAULT_SENSORS)
+
+        self.last_tick = monotonic()
+        self.next_tick = self.last_tick + STREAM_PERIOD
+        self.frames_sent = 0
+        self.commands = 0
+
+    def fileno(self):
+        return self.master
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+    # --- Sensor values -----------------------------------------------------
+
+    def value(self, packet_id):
+        """The current value of the sensor `packet_id`."""
+        if packet_id == 19:
+            ret = int(self.distance)
+            self.distance -= ret
+            return ret
+        if packet_id == 20:
+            ret = int(self.angle)
+            self.angle -= ret
+            return ret
+        if packet_id == 35:
+            return self.mode
+        if packet_id == 36:
+            return self.song_number
+        if packet_id == 38:
+            return len(self.stream_ids)
+        if packet_id == 39:
+            return self.velocity
+        if packet_id == 40:
+            return self.radius
+        if packet_id == 41:
+            return self.right
+        if packet_id == 42:
+            return self.left
+        return self.sensors.get(packet_id, 0)
+
+    def encode(self, packet_id):
+        lo, hi = packet_dct[packet_id]['ValueRange']
+        return PACKERS[packet_id].pack(min(max(self.value(packet_id), lo), hi))
+
+    def frame(self):
+        """Encode a stream packet for the current sensor values."""
+        body = bytearray()
+        for i in self.stream_ids:
+            body.append(i)
+            body += self.encode(i)
+        pkt = bytearray((19, len(body))) + body
+        pkt.append(-sum(pkt) % 256)
+        return pkt
+
+    # --- Time --------------------------------------------------------------
+
+    def tick(self, now):
+        """Advance the simulation to `now`, sending a stream packet if due."""
+        dt = now - self.last_tick
+        self.last_tick = now
+        self.distance += dt * (self.right + self.left) / 2
+        self.angle += math.degrees(dt * (self.right - self.left) / WHEEL_BASE)
+        if now >= self.next_tick:
+            self.next_tick += STREAM_PERIOD
+            if self.next_tick < now:
+                self.next_tick = now + STREAM_PERIOD
+            if self.streaming and self.stream_ids:
+                self.send(self.frame())
+                self.frames_sent += 1
+
+    def send(self, data):
+        try:
+            os.write(self.master, data)
+        except BlockingIOError:
+            pass
+
+    # --- Commands ----------------------------------------------------------
+
+    def on_readable(self):
+        try:
+            self.inbox += os.read(self.master, 4096)
+        except BlockingIOError:
+            return
+        self.tick(monotonic())
+        while self.inbox:
+            size = command_size(self.inbox)
+            if size is None or size > len(self.inbox):
+                break
+            cmd = bytes(self.inbox[:size])
+            del self.inbox[:size]
+            self.execute(cmd)
+
+    def execute(self, cmd):
+        op = cmd[0]
+        self.commands += 1
+        if op == create.OP_START:
+            self.mode = 1
+        elif op == create.OP_SOFT_RESET:
+            self.reset()
+        elif self.mode == 0:
+            # the OI ignores everything else until started
+            return
+        elif op == create.OP_BAUD:
+            self.baud_code = cmd[1]
+        elif op in (create.OP_CONTROL, create.OP_SAFE):
+            self.mode = 2
+        elif op == create.OP_FULL:
+            self.mode = 3
+        elif op == create.OP_STREAM:
+            self.stream_ids = [i for i in cmd[2:] if i in packet_dct]
+            self.streaming = True
+        elif op == create.OP_PAUSE:
+            self.streaming = bool(cmd[1])
+        elif op == create.OP_QUERY:
+            if cmd[1] in packet_dct:
+                self.send(self.encode(cmd[1]))
+        elif op == create.OP_QUERY_LIST:
+            self.send(b"".join(self.encode(i) for i in cmd[2:] if i in packet_dct))
+        elif op == create.OP_SCRIPT:
+            self.script = cmd[2:]
+        elif op == create.OP_SHOW_SCRIPT:
+            self.send(bytes([len(self.script)]) + self.script)
+        elif op == create.OP_SONG:
+            self.songs[cmd[1]] = cmd[3:]
+        elif op == create.OP_PLAY_SONG:
+            self.song_number = cmd[1]
+        elif self.mode < 2:
+            # actuator commands require safe or full mode
+            return
+        elif op == create.OP_DRIVE:
+            self.drive(*struct.unpack(">hh", cmd[1:]))
+        elif op == create.OP_DRIVE_DIRECT:
+            self.right, self.left = struct.unpack(">hh", cmd[1:])
+            self.velocity = (self.right + self.left) // 2
+            self.radius = 0
+        elif op == create.OP_LEDS:
+            self.leds = tuple(cmd[1:])
+        elif op == create.OP_LSD:
+            self.lsd = cmd[1]
+        elif op == create.OP_PWM_LSD:
+            self.pwm_lsd = tuple(cmd[1:])
+        elif op == create.OP_DIGITAL_OUTPUTS:
+            self.digital_outputs = cmd[1]
+
+    def reset(self):
+        """Return to the state after the bootloader has run."""
+        self.mode = 0
+        self.streaming = False
+        self.stream_ids = []
+        self.drive(0, 0)
+
+    def drive(self, velocity, radius):
+        """Set the wheel velocities for the drive command."""
+        self.velocity = velocity
+        self.radius = radius
+        if radius in (0, 32767, -32768) or velocity == 0:
+            self.right = self.left = velocity
+        elif radius == 1:
+            self.right, self.left = velocity, -velocity
+        elif radius == -1:
+            self.right, self.left = -velocity, velocity
+        else:
+            self.right = int(velocity * (radius + WHEEL_BASE / 2) / radius)
+            self.left = int(velocity * (radius - WHEEL_BASE / 2) / radius)
+
+
+class Simulator:
+    """Run several virtual robots from a single thread."""
+    def __init__(self, num_robots=1):
+        self.robots = [VirtualCreate() for _ in range(num_robots)]
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+        for robot in self.robots:
+            robot.close()
+
+    def run(self):
+        sel = selectors.DefaultSelector()
+        for robot in self.robots:
+            sel.register(robot, selectors.EVENT_READ)
+        while not self.done.is_set():
+            timeout = min(r.next_tick for r in self.robots) - monotonic()
+            for key, _ in sel.select(max(0, min(timeout, 0.1))):
+                key.fileobj.on_readable()
+            now = monotonic()
+            for robot in self.robots:
+                if robot.next_tick <= now:
+                    robot.tick(now)
+        sel.close()
+
+
+if __name__ == "__main__":
+    import sys
+    sim = Simulator(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
+    for robot in sim.robots:
+        print(robot.port_name)
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        pass
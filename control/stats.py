@@ -0,0 +1,55 @@
+"""
+Simple statistics for timing measurements.
+"""
+import math
+
+
+class Histogram:
+    """A fixed-width histogram of durations (in seconds).
+
+    Values beyond the last bin are counted in the last bin, but the exact
+    maximum is tracked separately.
+    """
+    def __init__(self, width=0.0005, num_bins=60):
+        self.width = width
+        self.counts = [0] * num_bins
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, x):
+        ix = int(x / self.width)
+        if ix >= len(self.counts):
+            ix = len(self.counts) - 1
+        elif ix < 0:
+            ix = 0
+        self.counts[ix] += 1
+        self.count += 1
+        self.total += x
+        if x > self.max:
+            self.max = x
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def percentile(self, q):
+        """An upper bound on the `q`-th percentile (0 <= q <= 100)."""
+        if not self.count:
+            return math.nan
+        target = q / 100 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                if i == len(self.counts) - 1:
+                    break
+                return min((i + 1) * self.width, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.mean,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max}
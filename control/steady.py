@@ -0,0 +1,193 @@
+"""
+An allocation-free steady-state control loop.
+
+The garbage collector runs whenever enough container objects (lists,
+dicts, tuples, ...) have been allocated, which in an ordinary loop means at
+random points within a tick. `SteadyLoop` avoids that:
+
+    - the stream is parsed into a `StateBoard`, which holds the latest value
+      of each sensor in preallocated storage, instead of a dict per frame
+    - the port is read into a preallocated buffer by the loop itself, rather
+      than by a reader thread passing frames through a queue (but handled
+      the same way, by `Controller.read_chunk()`, so recording, the watchdog,
+      the actuation probe and reconnecting all still work)
+    - commands are encoded into the controller's reusable buffers (as always)
+    - after setup, everything allocated so far is moved out of the
+      collector's reach with `gc.freeze()`, automatic collection is turned
+      off, and the young generation is collected only when there is slack
+      before the next frame is due
+
+With `trace=True`, `tracemalloc` measures the memory allocated in each tick
+(at peak, and still held at the end), to check that it stays near zero.
+
+Example:
+    def step(board):
+        if board['BumpsAndWheelDrops']:
+            robot.stop()
+
+    loop = SteadyLoop(robot, [7, 19, 20], step)
+    robot.request_stream(7, 19, 20)
+    loop.run()
+"""
+import gc
+import select
+import tracemalloc
+
+import schema
+from bandwidth import STREAM_PERIOD
+from csp3 import csp3
+from stats import Histogram
+
+
+class StateBoard:
+    """The latest values of the streamed sensors, updated in place."""
+    def __init__(self, layout=None):
+        self.names = []
+        self.values = []
+        self.index = {}
+        self.count = 0
+        self.stamp = 0.0
+        if layout is not None:
+            self.set_layout(layout)
+
+    def set_layout(self, layout):
+        self.names = list(layout.names)
+        self.values = [0] * len(self.names)
+        self.index = {name: ix for ix, name in enumerate(self.names)}
+
+    def update(self, values):
+        """Store a frame's values (as unpacked by the parser)."""
+        self.values[:] = values
+        self.count += 1
+
+    def __getitem__(self, name):
+        return self.values[self.index[name]]
+
+    def get(self, name, default=None):
+        ix = self.index.get(name)
+        return default if ix is None else self.values[ix]
+
+    def as_dict(self):
+        return dict(zip(self.names, self.values))
+
+
+class SteadyLoop:
+    def __init__(self, robot, sensor_ids, step, every=1, chunk_size=256,
+                 gc_slack=0.002, trace=False):
+        """
+        Args:
+            robot: the `Controller` for the robot.
+            sensor_ids: the sensors in the stream.
+            step: a function called with the `StateBoard` once per tick.
+            every: the number of frames per tick.
+            chunk_size: the size of the read buffer.
+            gc_slack: the least time before the next frame is due for which
+                it is worth running a collection.
+            trace: whether to measure allocations with `tracemalloc`.
+        """
+        self.robot = robot
+        self.step = step
+        self.every = every
+        self.gc_slack = gc_slack
+        self.trace = trace
+        self.board = StateBoard(schema.layout(sensor_ids))
+        self.parser = csp3(sensor_ids, board=self.board)
+        self.buf = bytearray(chunk_size)
+        self.view = memoryview(self.buf)
+        self.poller = select.poll()
+        self.running = False
+
+        # Statistics
+        self.ticks = 0
+        self.skipped = 0
+        self.exec_time = Histogram()
+        self.collections = 0
+        self.gc_time = Histogram(width=0.00005)
+        self.peak_bytes = 0
+        self.retained_bytes = 0
+
+    def stop(self):
+        """Stop the loop (e.g., from within the step function)."""
+        self.running = False
+
+    def run(self, max_ticks=None, timeout=0.1):
+        """Run the loop until `stop()` is called or `max_ticks` have run."""
+        if self.robot.reader is not None:
+            raise RuntimeError("Stop the reader thread before running a SteadyLoop")
+        robot = self.robot
+        fd = robot.ser.fileno()
+        self.poller.register(fd, select.POLLIN)
+        timeout_ms = int(timeout * 1000)
+        board = self.board
+        seen = board.count
+        gc_enabled = gc.isenabled()
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        if self.trace:
+            tracemalloc.start()
+        self.running = True
+        try:
+            while self.running and (max_ticks is None or self.ticks < max_ticks):
+                if self.trace:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                if not self.poller.poll(timeout_ms):
+                    continue
+                stamp = robot.read_chunk(fd, self.view, self.parser)
+                if stamp is None:
+                    if robot.ser.fileno() != fd:
+                        # reconnected
+                        self.poller.unregister(fd)
+                        fd = robot.ser.fileno()
+                        self.poller.register(fd, select.POLLIN)
+                    continue
+                board.stamp = stamp
+                frames = board.count - seen
+                if frames < self.every:
+                    continue
+                seen = board.count
+                self.skipped += frames // self.every - 1
+                self.tick()
+                if self.trace:
+                    current, peak = tracemalloc.get_traced_memory()
+                    self.peak_bytes = max(self.peak_bytes, peak - before)
+                    self.retained_bytes += current - before
+                self.collect_in_slack()
+        finally:
+            self.poller.unregister(fd)
+            if self.trace:
+                tracemalloc.stop()
+            gc.unfreeze()
+            if gc_enabled:
+                gc.enable()
+
+    def tick(self):
+        clock = self.robot.clock
+        start = clock()
+        with self.robot.batch():
+            self.step(self.board)
+        self.ticks += 1
+        self.exec_time.add(clock() - start)
+
+    def collect_in_slack(self):
+        """Collect the young generation if there's time before the next frame."""
+        clock = self.robot.clock
+        now = clock()
+        due = self.board.stamp + STREAM_PERIOD
+        if due - now < self.gc_slack or not gc.get_count()[0]:
+            return
+        gc.collect(0)
+        self.collections += 1
+        self.gc_time.add(clock() - now)
+
+    def report(self):
+        ret = {'ticks': self.ticks,
+               'skipped': self.skipped,
+               'exec_time': self.exec_time.summary(),
+               'collections': self.collections,
+               'gc_time': self.gc_time.summary()}
+        if self.trace and self.ticks:
+            ret['peak_bytes_per_tick'] = self.peak_bytes
+            ret['retained_bytes_per_tick'] = self.retained_bytes / self.ticks
+        return ret
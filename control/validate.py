@@ -0,0 +1,46 @@
+"""
+Range validation for parsed sensor frames.
+
+A frame can pass the checksum and still contain garbage (e.g., after a
+brown-out), so each sensor value is compared against the `ValueRange` listed
+for it in `packet_dct` (via the compiled bounds in `schema.py`).
+Checks are done on whole batches of frames at once, with the bounds stored as
+NumPy arrays, so the cost per frame is a handful of vectorized comparisons.
+
+The result for each frame is an anomaly bitmask: bit `i` is set if the `i`-th
+sensor in the stream was out of range, so a mask of zero means "all good".
+"""
+import numpy as np
+
+import schema
+
+
+class RangeValidator:
+    def __init__(self, layout):
+        """Set up a validator for a `schema.StreamLayout` or list of sensors."""
+        if not isinstance(layout, schema.StreamLayout):
+            layout = schema.layout(layout)
+        self.sensor_lst = layout.sensor_lst
+        self.lo = np.array(layout.lo)
+        self.hi = np.array(layout.hi)
+        # Bit values for each sensor's position in the stream
+        self.bits = np.left_shift(np.uint64(1),
+                                  np.arange(len(self.sensor_lst), dtype=np.uint64))
+
+    def check(self, batch):
+        """Compute the anomaly bitmask for each frame in `batch`.
+
+        Args:
+            batch: array-like of shape (num_frames, num_sensors).
+
+        Returns:
+            np.ndarray: uint64 array of length `num_frames`.
+        """
+        arr = np.asarray(batch).reshape(-1, len(self.sensor_lst))
+        bad = (arr < self.lo) | (arr > self.hi)
+        return np.bitwise_or.reduce(np.where(bad, self.bits, np.uint64(0)),
+                                    axis=1)
+
+    def flagged(self, mask):
+        """Return the IDs of the sensors flagged in `mask`."""
+        return [x for i, x in enumerate(self.sensor_lst) if int(mask) >> i & 1]
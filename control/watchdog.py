@@ -0,0 +1,105 @@
+"""
+A watchdog that stops the robot if the sensor stream stalls.
+
+If the serial link hiccups or the parser falls behind, the robot keeps
+driving with its last command. The watchdog runs a timer thread that checks
+when the last frame arrived; after `missed` stream periods without a frame it
+writes a (pre-encoded) stop command straight to the port, bypassing any
+batching or queueing, and reports a `StreamStall`. Drive commands that were
+waiting to be sent (in the latest-wins slot, or in the writer thread's queue)
+are discarded, so the robot doesn't drive off again after the stop.
+Detection latency is bounded by the timer, not by the arrival of the next
+byte: a stall is detected at most `(missed + 1)` periods after the last frame.
+
+The controller's reader thread feeds the watchdog as frames arrive; see
+`Controller.start_watchdog()`.
+"""
+import os
+import threading
+from time import monotonic
+
+from bandwidth import STREAM_PERIOD
+from commands import COMMANDS
+from recorder import WRITE
+from writequeue import SAFETY
+
+
+class StreamStall(Exception):
+    """Raised (or passed to callbacks) when the stream stalls."""
+    def __init__(self, last_frame, detected, missed):
+        self.last_frame = last_frame
+        self.detected = detected
+        self.missed = missed
+        super().__init__("No frames for %.3f s (%d periods); robot stopped" %
+                         (detected - last_frame, missed))
+
+
+class Watchdog:
+    def __init__(self, robot, missed=3, period=STREAM_PERIOD, on_stall=None):
+        """
+        Args:
+            robot: the `Controller` for the robot.
+            missed: the number of missed frames that counts as a stall.
+            period: the expected time between frames.
+            on_stall: a function called (from the watchdog thread) with the
+                `StreamStall` when a stall is detected.
+        """
+        self.robot = robot
+        self.missed = missed
+        self.period = period
+        self.on_stall = on_stall
+        self.stop_cmd = COMMANDS['drive_direct'].encode(0, 0)
+        self.last = monotonic()
+        self.stall = None
+        self.stalls = []
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def stalled(self):
+        return self.stall is not None
+
+    def start(self):
+        self.last = monotonic()
+        self.thread.start()
+
+    def cancel(self):
+        self.done.set()
+        self.thread.join()
+
+    def feed(self, timestamp=None):
+        """Record the arrival of a frame (re-arming after a stall)."""
+        self.last = monotonic() if timestamp is None else timestamp
+        self.stall = None
+
+    def _run(self):
+        limit = self.missed * self.period
+        while not self.done.wait(self.period):
+            now = monotonic()
+            if self.stall is None and now - self.last > limit:
+                self.fire(now)
+
+    def fire(self, now):
+        """Stop the robot and report the stall."""
+        robot = self.robot
+        with robot.drive_lock:
+            if robot.drive_pending is not None:
+                robot.drive_dropped += 1
+            robot.drive_pending = None
+        try:
+            os.write(robot.ser.fileno(), self.stop_cmd)
+        except (OSError, ValueError):
+            # the port has gone away (e.g., while reconnecting)
+            pass
+        if robot.recorder is not None:
+            robot.recorder.record(WRITE, self.stop_cmd)
+        writer = robot.writer
+        if writer is not None:
+            # discards the queued drive commands, and stops again after one
+            # the writer may already be sending
+            writer.put(self.stop_cmd, SAFETY)
+        self.stall = StreamStall(self.last, now,
+                                 int((now - self.last) / self.period))
+        self.stalls.append(self.stall)
+        if self.on_stall is not None:
+            self.on_stall(self.stall)
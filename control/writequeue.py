@@ -0,0 +1,173 @@
+"""
+A priority queue for commands, so that safety commands are never stuck
+behind bulk traffic.
+
+With a `WriteQueue` running (see `Controller.start_writer()`), writes are
+handed to a writer thread in one of three classes:
+
+    SAFETY      stopping the robot, and switching to safe/passive mode
+    CONTROL     drive commands, mode changes, stream requests (the default)
+    BACKGROUND  songs, scripts, LEDs, digital outputs and IR
+
+Safety and control writes are sent in the order they were queued (so that,
+e.g., the last mode change wins), ahead of any background writes, which are
+also sent in order. Playing (or showing) a song or script is a background
+write like defining it, so it can never overtake the definition queued
+before it. A stop supersedes any drive commands still queued, which are
+discarded rather than sent after it. Background payloads are split into chunks of at most `chunk_size` bytes (on command
+boundaries, since the robot would otherwise read an interleaved command as
+data), and a chunk is only written once the port has transmitted everything
+before it, so a safety command waits behind at most one chunk -- or one
+command, for a single command longer than `chunk_size` (e.g., a script).
+
+`report()` gives the latency of each class, from the write being queued to
+it being handed to the port.
+"""
+import threading
+import itertools
+from collections import deque
+
+import create_v1 as create
+from commands import split_commands
+from stats import Histogram
+
+SAFETY, CONTROL, BACKGROUND = range(3)
+CLASS_NAMES = ('safety', 'control', 'background')
+
+BACKGROUND_OPCODES = {create.OP_SONG, create.OP_PLAY_SONG, create.OP_SCRIPT,
+                      create.OP_PLAY_SCRIPT, create.OP_SHOW_SCRIPT,
+                      create.OP_LEDS, create.OP_DIGITAL_OUTPUTS,
+                      create.OP_SEND_IR}
+SAFETY_OPCODES = {create.OP_START, create.OP_SAFE}
+
+
+def priority_of(data):
+    """The class of a write, judged by its first command."""
+    op = data[0]
+    if op in SAFETY_OPCODES or is_stop(data):
+        return SAFETY
+    if op in BACKGROUND_OPCODES:
+        return BACKGROUND
+    return CONTROL
+
+
+def is_stop(data):
+    """Check if a write starts with a drive command that stops the robot."""
+    op = data[0]
+    if op == create.OP_DRIVE and len(data) >= 3 and data[1] == data[2] == 0:
+        return True
+    return op == create.OP_DRIVE_DIRECT and len(data) >= 5 and not any(data[1:5])
+
+
+def is_drive(data):
+    """Check if a write is a single drive command."""
+    return len(data) == 5 and data[0] in (create.OP_DRIVE, create.OP_DRIVE_DIRECT)
+
+
+class WriteQueue:
+    def __init__(self, robot, chunk_size=16):
+        """
+        Args:
+            robot: the `Controller` to write to (via `write_now()`).
+            chunk_size: the largest chunk of background data written at once.
+        """
+        self.robot = robot
+        self.chunk_size = chunk_size
+        # Items are `(seq, stamp, data)`, `seq` giving the order they were queued
+        self.queues = [deque() for _ in CLASS_NAMES]
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.done = False
+        # how often to check whether the port has drained, while background
+        # data is waiting: about a quarter of the time to send one chunk
+        self.poll = chunk_size * 10 / robot.baudrate / 4
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+        # Statistics
+        self.latency = [Histogram() for _ in CLASS_NAMES]
+        self.superseded = 0
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        """Write everything still queued, then stop the writer thread."""
+        with self.cond:
+            self.done = True
+            self.cond.notify()
+        self.thread.join()
+
+    def put(self, data, priority=None):
+        """Queue `data` to be written; `priority` defaults to `priority_of()`."""
+        if priority is None:
+            priority = priority_of(data)
+        stamp = self.robot.clock()
+        with self.cond:
+            if priority == BACKGROUND:
+                for chunk in self.chunks(data):
+                    self.queues[BACKGROUND].append((next(self.seq), stamp, chunk))
+            else:
+                if priority == SAFETY and is_stop(data):
+                    self.discard_drives()
+                self.queues[priority].append((next(self.seq), stamp, bytes(data)))
+            self.cond.notify()
+
+    def discard_drives(self):
+        """Drop the drive commands still queued (with `cond` held)."""
+        control = self.queues[CONTROL]
+        for _ in range(len(control)):
+            item = control.popleft()
+            if is_drive(item[2]):
+                self.superseded += 1
+            else:
+                control.append(item)
+
+    def chunks(self, data):
+        """Split `data` into chunks of whole commands."""
+        chunk = bytearray()
+        for cmd in split_commands(bytes(data)):
+            if chunk and len(chunk) + len(cmd) > self.chunk_size:
+                yield bytes(chunk)
+                chunk.clear()
+            chunk += cmd
+        if chunk:
+            yield bytes(chunk)
+
+    def pending(self, priority=BACKGROUND):
+        """The number of writes queued at `priority` or more urgent."""
+        return sum(len(q) for q in self.queues[:priority + 1])
+
+    def drained(self):
+        try:
+            return self.robot.ser.out_waiting == 0
+        except OSError:
+            return True
+
+    def _next(self):
+        with self.cond:
+            while True:
+                # safety and control writes keep the order they were queued in
+                safety, control = self.queues[SAFETY], self.queues[CONTROL]
+                if safety and (not control or safety[0][0] < control[0][0]):
+                    return SAFETY, safety.popleft()
+                if control:
+                    return CONTROL, control.popleft()
+                if self.queues[BACKGROUND] and self.drained():
+                    return BACKGROUND, self.queues[BACKGROUND].popleft()
+                if self.done and not self.pending():
+                    return None
+                self.cond.wait(self.poll if self.queues[BACKGROUND] else None)
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            priority, (_, stamp, data) = item
+            self.robot.write_now(data)
+            self.latency[priority].add(self.robot.clock() - stamp)
+
+    def report(self):
+        ret = {name: hist.summary() for name, hist in zip(CLASS_NAMES, self.latency)}
+        ret['superseded'] = self.superseded
+        return ret